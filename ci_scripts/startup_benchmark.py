@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Check that the mbm command line tool starts within its import time budget
+
+The commands are run with python -X importtime and the time spent
+importing modules that are not imported by the bare interpreter is
+compared against the budget.  Commands that don't talk to boards must also
+not import any of the slow modules that are only needed to talk to boards
+or run the server.  Subcommands that are run must only import the slow
+modules they use.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts', 'micropython_board_manager')
+
+# Import time budget in milliseconds
+DEFAULT_BUDGET = 50
+
+# Commands that exit while parsing the arguments, they must stay within the
+# budget and not import any of the slow modules
+COMMANDS = [
+    ['--help'],
+    ['board-list', '--help'],
+    ['board-install', '--help'],
+    ['server-status', '--help'],
+]
+
+# Commands that run a subcommand and the slow modules the subcommand needs.
+# They run against a missing rdb file or an unreachable redis server in a
+# temporary directory, so they get past the subcommand dispatch without a
+# server running.
+SUBCOMMANDS = [
+    (['server-status', '--rdbfile', '{directory}/missing.rdb'], ['redis', 'redislite']),
+    (['--redis-url', 'unix://{directory}/missing.socket', 'board-list'], ['redis']),
+]
+
+SLOW_MODULES = [
+    'daemon', 'hostlists', 'multiprocessing', 'netifaces', 'redis', 'redislite', 'requests', 'tarfile', 'telnetlib'
+]
+
+
+def import_times(arguments):
+    """
+    Run python with -X importtime and parse the import times
+
+    Returns
+    -------
+    dict
+        Dictionary mapping each top level import to a tuple of the
+        cumulative import time in microseconds and the modules it imported
+    """
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(SCRIPT))] + [path for path in [environment.get('PYTHONPATH')] if path]
+    )
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + arguments, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        env=environment
+    )
+    imports = {}
+    nested = []
+    for line in process.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        module = name.strip()
+        nested.append(module)
+        # Each line is printed after the modules it imported
+        if name[1:2] != ' ':
+            imports[module] = (int(cumulative), nested)
+            nested = []
+    return imports
+
+
+def measure(arguments, baseline, repeat):
+    """
+    Measure the import time of a command
+
+    Returns
+    -------
+    tuple
+        The import time in milliseconds, the fastest of repeat runs, and the
+        modules imported by the command
+    """
+    best = None
+    modules = set()
+    for _ in range(repeat):
+        imports = import_times([SCRIPT] + arguments)
+        total = 0
+        for module, (cumulative, nested) in imports.items():
+            if module in baseline:
+                continue
+            total += cumulative
+            modules.update(nested)
+        if best is None or total < best:
+            best = total
+    return best / 1000.0, modules
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--budget', default=DEFAULT_BUDGET, type=float, help='Import time budget in milliseconds')
+    parser.add_argument('--repeat', default=5, type=int, help='Number of times to run each command')
+    args = parser.parse_args()
+
+    baseline = set(import_times(['-c', 'pass']).keys())
+    failed = False
+    for arguments in COMMANDS:
+        elapsed, modules = measure(arguments, baseline, args.repeat)
+        slow = sorted(module for module in modules if module.split('.')[0] in SLOW_MODULES)
+        status = 'ok'
+        if elapsed > args.budget or slow:
+            status = 'FAILED'
+            failed = True
+        print('%-30s %7.1fms %s' % ('mbm ' + ' '.join(arguments), elapsed, status))
+        if slow:
+            print('    imports slow modules: %s' % ', '.join(slow))
+
+    directory = tempfile.mkdtemp()
+    try:
+        for template, needed in SUBCOMMANDS:
+            arguments = [argument.format(directory=directory) for argument in template]
+            label = ' '.join(argument.format(directory='<tmp>') for argument in template)
+            elapsed, modules = measure(arguments, baseline, 1)
+            slow = sorted(
+                module for module in modules
+                if module.split('.')[0] in SLOW_MODULES and module.split('.')[0] not in needed
+            )
+            status = 'ok'
+            if slow:
+                status = 'FAILED'
+                failed = True
+            print('%-30s %7.1fms %s' % ('mbm ' + label, elapsed, status))
+            if slow:
+                print('    imports slow modules: %s' % ', '.join(slow))
+    finally:
+        shutil.rmtree(directory)
+    if failed:
+        print('The mbm startup checks failed, the import time budget is %.0fms' % args.budget)
+        sys.exit(1)
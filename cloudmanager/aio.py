@@ -0,0 +1,931 @@
+"""
+Asyncio client API for cloudmanager boards
+
+The classes in this module mirror MicropythonBoard and MicropythonBoards
+using an asyncio redis client connected to the same redis server, so many
+operations on many boards can be in flight on a single event loop.
+"""
+import asyncio
+import functools
+import hashlib
+import logging
+import time
+import uuid
+import hostlists
+import redis
+import redis.asyncio
+from .board import (
+    COMPRESSION_WBITS, CONSOLE_STREAM_MAXLEN, CREATE_TRANSACTION_SCRIPT, MACROS, UploadResult, copy_succeeded,
+    encode_data
+)
+from .boardinfo import BOARDINFO_CACHE
+from .exceptions import BoardNotResponding, NoSuchBoard
+from .fanout import DEFAULT_CONCURRENCY
+from .registry import BOARD_REGISTRY_KEY, registered_board_names
+from .utility import connect_to_redis, redis_url
+
+
+LOG = logging.getLogger(__name__)
+
+
+def connect(redis_db=None, url=None):
+    """
+    Create an asyncio redis client for the cloudmanager redis server
+
+    Parameters
+    ----------
+    redis_db : redislite.Redis, optional
+        The synchronous connection to the local server, default is the one
+        returned by connect_to_redis(), which starts the server if needed
+
+    url : str, optional
+        The URL of a remote redis server, default is the URL returned by
+        redis_url()
+
+    Returns
+    -------
+    tuple
+        The redis.asyncio.Redis client and the synchronous connection, which
+        needs to be kept to keep an embedded server running.  The
+        synchronous connection is None for a remote server.
+    """
+    if url is None and redis_db is None:
+        url = redis_url()
+    if url:
+        return redis.asyncio.Redis.from_url(url), None
+    if redis_db is None:
+        redis_db = connect_to_redis()
+    return redis.asyncio.Redis(unix_socket_path=redis_db.socket_file), redis_db
+
+
+def sync_client(client):
+    """
+    Create a synchronous redis client for the server an asyncio redis client
+    is connected to
+
+    Parameters
+    ----------
+    client : redis.asyncio.Redis
+        The asyncio redis client
+
+    Returns
+    -------
+    redis.Redis
+        The synchronous redis client
+    """
+    settings = client.connection_pool.connection_kwargs
+    kwargs = dict(
+        db=settings.get('db', 0), username=settings.get('username'), password=settings.get('password')
+    )
+    if settings.get('path'):
+        return redis.Redis(unix_socket_path=settings['path'], **kwargs)
+    return redis.Redis(
+        host=settings.get('host', 'localhost'), port=settings.get('port', 6379),
+        ssl=issubclass(client.connection_pool.connection_class, redis.asyncio.SSLConnection), **kwargs
+    )
+
+
+class AsyncCompletionDispatcher(object):
+    """
+    Wait for completions from many boards using a single BLPOP
+
+    The asyncio version of cloudmanager.fanout.CompletionDispatcher, a
+    single task issues one BLPOP across the complete key of every board
+    that is being waited on and resolves the future of the waiting
+    coroutine.
+    """
+    def __init__(self, redis_db, poll_interval=1):
+        self.redis_db = redis_db
+        self.poll_interval = poll_interval
+        self.wakeup_key = 'dispatcher:' + uuid.uuid4().hex + '.wakeup'
+        self._waiters = {}
+        self._task = None
+
+    async def wait(self, board, timeout=None, check_state=True):
+        """
+        Wait for a board to push a value to its complete key
+
+        Parameters
+        ----------
+        board : AsyncMicropythonBoard
+            The board to wait on
+
+        timeout : int, optional
+            Number of seconds to wait, default None waits until the board
+            completes or stops responding
+
+        check_state : bool, optional
+            Raise BoardNotResponding if the board goes idle or away while
+            waiting, default=True
+
+        Returns
+        -------
+        bytes or None
+            The value the board pushed to the complete key or None if the
+            timeout expired
+
+        Raises
+        ------
+        BoardNotResponding
+            The board stopped responding before completing
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[board.complete_key] = (board, future, time.time(), check_state)
+        if not self._task:
+            self._task = asyncio.ensure_future(self._run())
+        await self._wakeup()
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if self._waiters.get(board.complete_key, (None, None))[1] is future:
+                del self._waiters[board.complete_key]
+                return
+            # The result was delivered while the timeout was being handled
+            return future.result()
+        except asyncio.CancelledError:
+            if self._waiters.get(board.complete_key, (None, None))[1] is future:
+                del self._waiters[board.complete_key]
+            raise
+
+    async def _wakeup(self):
+        """
+        Interrupt the running BLPOP so it picks up newly registered keys
+        """
+        pipeline = self.redis_db.pipeline()
+        pipeline.rpush(self.wakeup_key, 1)
+        pipeline.expire(self.wakeup_key, 60)
+        await pipeline.execute()
+
+    def _deliver(self, complete_key, value):
+        """
+        Resolve the future of the waiter for a complete key
+
+        Returns
+        -------
+        bool
+            False if there is no waiter for the key
+        """
+        entry = self._waiters.pop(complete_key, None)
+        if not entry or entry[1].done():
+            return False
+        if isinstance(value, Exception):
+            entry[1].set_exception(value)
+        else:
+            entry[1].set_result(value)
+        return True
+
+    async def _deliver_popped(self, complete_key, value):
+        """
+        Deliver a value popped from a complete key, the value is put back
+        for the next wait on the board if the waiter has timed out
+        """
+        if not self._deliver(complete_key, value):
+            await self.redis_db.lpush(complete_key, value)
+
+    async def _check_state(self):
+        """
+        Fail the waiters for boards that have gone idle or away without
+        completing.
+        """
+        now = time.time()
+        suspects = [
+            entry[0] for entry in self._waiters.values() if entry[3] and now - entry[2] >= self.poll_interval
+        ]
+        if not suspects:
+            return
+        states = await self.redis_db.mget([board.status_key for board in suspects])
+        for board, state in zip(suspects, states):
+            if state and state not in [b'idle']:
+                continue
+            # The board may have completed just before going idle
+            value = await self.redis_db.lpop(board.complete_key)
+            if value is not None:
+                await self._deliver_popped(board.complete_key, value)
+                continue
+            self._deliver(
+                board.complete_key, BoardNotResponding('Board {0} is not responding\n'.format(board.name))
+            )
+
+    def _fail_waiters(self, error):
+        """
+        Deliver an error to every waiter, the next wait() starts a new task
+        """
+        self._task = None
+        for complete_key in list(self._waiters.keys()):
+            self._deliver(complete_key, error)
+
+    async def _run(self):
+        last_check = time.time()
+        try:
+            while True:
+                if not self._waiters:
+                    # Let the next wait() start a new task, a wait() started
+                    # during the final delete would otherwise not be seen
+                    self._task = None
+                    break
+                keys = list(self._waiters.keys())
+                item = await self.redis_db.blpop(keys + [self.wakeup_key], timeout=self.poll_interval)
+                if item:
+                    key, value = item
+                    if isinstance(key, bytes):
+                        key = key.decode()
+                    if key != self.wakeup_key:
+                        await self._deliver_popped(key, value)
+                if time.time() - last_check >= self.poll_interval:
+                    await self._check_state()
+                    last_check = time.time()
+        except Exception as error:
+            self._fail_waiters(error)
+            return
+        try:
+            await self.redis_db.delete(self.wakeup_key)
+        except Exception:
+            # A task started by a later wait() is already handling the
+            # waiters, an error here doesn't affect them
+            LOG.debug('Failed to remove the dispatcher wakeup key', exc_info=True)
+
+
+class AsyncExecuteResult(object):
+    """
+    The output of a command run on a board
+
+    Iterating over the result with async for yields the output in chunks as
+    the board produces it, until the command completes.
+    """
+    chunk_size = 1024
+    poll_interval = .1
+    state_check_interval = 1
+
+    def __init__(self, board, return_code=0):
+        self.board = board
+        self.position = 0
+        self.return_code = return_code
+        self._last_state_check = time.time()
+        self._complete_published = False
+
+    async def _publish(self, entry_type, data):
+        if self.board.publish_output:
+            await self.board.publish(entry_type, data)
+
+    async def _publish_complete(self):
+        if self.return_code is None or self._complete_published:
+            return
+        self._complete_published = True
+        await self._publish('complete', self.return_code)
+
+    async def read(self, num_bytes=-1):
+        """
+        Read output from the current position
+
+        Parameters
+        ----------
+        num_bytes : int, optional
+            Maximum number of bytes to read, default -1 reads all of the
+            output currently available
+
+        Returns
+        -------
+        bytes
+            The output
+        """
+        if num_bytes == 0:
+            return b''
+        end = -1
+        if num_bytes > 0:
+            end = self.position + num_bytes - 1
+        result = await self.board.redis_db.getrange(self.board.stdout_key, self.position, end)
+        self.position += len(result)
+        if result:
+            await self._publish('output', result)
+        if num_bytes < 0:
+            await self._publish_complete()
+        return result
+
+    async def _poll_complete(self):
+        """
+        Check if the command has completed, waiting up to poll_interval
+        seconds if it has not.
+        """
+        rc = await self.board.redis_db.lpop(self.board.complete_key)
+        if rc is not None:
+            self.return_code = int(rc)
+            return
+        if time.time() - self._last_state_check < self.state_check_interval:
+            await asyncio.sleep(self.poll_interval)
+            return
+        self._last_state_check = time.time()
+        state = await self.board.state()
+        if not state or state in ['idle']:
+            # Check again in case the board completed before going idle
+            rc = await self.board.redis_db.lpop(self.board.complete_key)
+            if rc is None:
+                raise BoardNotResponding('Board {0} is not responding\n'.format(self.board.name))
+            self.return_code = int(rc)
+            return
+        await asyncio.sleep(self.poll_interval)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        while True:
+            output = await self.read(self.chunk_size)
+            if output:
+                yield output
+                continue
+            if self.return_code is not None:
+                await self._publish_complete()
+                return
+            await self._poll_complete()
+
+
+class AsyncMicropythonBoard(object):
+    """
+    A board managed by the cloudmanager, accessed with an asyncio redis
+    client.
+
+    Boards that return their output over telnet (wipy) are not supported.
+
+    Parameters
+    ----------
+    name : str
+        The name of the board
+
+    redis_db : redis.asyncio.Redis
+        The asyncio redis client
+
+    dispatcher : AsyncCompletionDispatcher, optional
+        Dispatcher used to wait for completions, default waits with a BLPOP
+        per board
+
+    publish_output : bool, optional
+        Publish the commands and output to the board's console stream
+    """
+    def __init__(self, name, redis_db, dispatcher=None, publish_output=None):
+        self.name = name
+        self.redis_db = redis_db
+        self.dispatcher = dispatcher
+        self.publish_output = publish_output
+        self.base_key = 'repl:' + name
+        self.status_key = 'board:' + name
+        self.stdout_key = self.base_key + '.console.stdout'
+        self.output_stream_key = self.base_key + '.console.stream'
+        self.complete_key = self.base_key + '.complete'
+        self.boardinfo_key = 'boardinfo:' + name
+        self.manifest_key = 'manifest:' + name
+        self.capabilities_key = 'boardcaps:' + name
+
+    def __repr__(self):
+        return '<AsyncMicropythonBoard %s>' % self.name
+
+    async def state(self):
+        """
+        Get the state of the board
+
+        Returns
+        -------
+        str or None
+            The board state, None if the board is not online
+        """
+        state = await self.redis_db.get(self.status_key)
+        if state is not None:
+            state = state.decode()
+        return state
+
+    async def platform(self):
+        """
+        Get the platform of the board from its boardinfo
+
+        Returns
+        -------
+        str or None
+            The board platform
+        """
+        platform = await self.redis_db.get(self.boardinfo_key)
+        if platform is not None:
+            platform = platform.decode()
+            BOARDINFO_CACHE.set(self.name, platform)
+        return platform
+
+    async def rename(self, name):
+        """
+        Rename the board
+
+        Parameters
+        ----------
+        name : str
+            The new name of the board
+        """
+        key = self.base_key + '.rename'
+        pipeline = self.redis_db.pipeline(transaction=True)
+        pipeline.rpush(key, name)
+        pipeline.expire(key, 30)
+        await pipeline.execute()
+        BOARDINFO_CACHE.invalidate(self.name)
+        BOARDINFO_CACHE.invalidate(name)
+
+    async def publish(self, entry_type, data, redis_db=None):
+        """
+        Add an entry to the board's console output stream
+
+        Parameters
+        ----------
+        entry_type : str
+            The type of entry, one of command, output or complete
+
+        data : bytes or str
+            The entry data
+
+        redis_db : redis.asyncio.client.Pipeline, optional
+            Queue the entry in this pipeline instead of sending it
+        """
+        command = (redis_db or self.redis_db).xadd(
+            self.output_stream_key, {'type': entry_type, 'data': data}, maxlen=CONSOLE_STREAM_MAXLEN,
+            approximate=True
+        )
+        if redis_db is None:
+            await command
+
+    async def follow(self, last_id='$', block=1000, count=100):
+        """
+        Follow the board's console output stream
+
+        Parameters
+        ----------
+        last_id : str, optional
+            The stream id to follow from, default follows new entries
+
+        block : int, optional
+            Milliseconds to wait for new entries per read, default=1000
+
+        count : int, optional
+            Maximum number of entries per read, default=100
+
+        Yields
+        ------
+        tuple
+            (entry_type, data) tuples
+        """
+        if last_id == '$':
+            # Follow from the current last entry, re-sending $ would skip
+            # entries added between two reads
+            last_entries = await self.redis_db.xrevrange(self.output_stream_key, count=1)
+            last_id = last_entries[0][0] if last_entries else '0-0'
+        while True:
+            response = await self.redis_db.xread({self.output_stream_key: last_id}, count=count, block=block)
+            for stream_key, stream_entries in response or []:
+                for entry_id, fields in stream_entries:
+                    last_id = entry_id
+                    yield fields[b'type'].decode(), fields[b'data']
+
+    async def start_execute(self, command):
+        """
+        Send a command to the board without waiting for it to complete
+
+        Parameters
+        ----------
+        command : str
+            The python code to execute on the board
+        """
+        command_key = self.base_key + '.command'
+        pipeline = self.redis_db.pipeline(transaction=True)
+        pipeline.delete(self.stdout_key, self.complete_key)
+        pipeline.rpush(command_key, command)
+        pipeline.expire(command_key, 10)
+        pipeline.expire(self.status_key, 10)
+        if self.publish_output:
+            await self.publish('command', command, redis_db=pipeline)
+        await pipeline.execute()
+
+    async def _wait_complete(self, timeout=None, check_state=True):
+        """
+        Wait for the board to push a value to the complete key
+
+        Returns
+        -------
+        bytes or None
+            The value from the complete key or None if the timeout expired
+        """
+        if self.dispatcher:
+            return await self.dispatcher.wait(self, timeout=timeout, check_state=check_state)
+
+        start = time.time()
+        while True:
+            rc = await self.redis_db.blpop(self.complete_key, timeout=1)
+            if rc is not None:
+                return rc[1]
+
+            if check_state:
+                state = await self.state()
+                if not state or state in ['idle']:
+                    raise BoardNotResponding('Board {0} is not responding\n'.format(self.name))
+
+            if timeout and time.time() - start >= timeout:
+                return
+
+    async def execute(self, command, wait=True):
+        """
+        Execute a command on the board
+
+        Parameters
+        ----------
+        command : str
+            The python code to execute on the board
+
+        wait : bool, optional
+            Wait for the command to complete before returning, default=True.
+            If False the result is returned as soon as the command is sent
+            and iterating over it streams the output as the board runs.
+
+        Returns
+        -------
+        AsyncExecuteResult
+            The result of the command
+        """
+        await self.start_execute(command)
+        if not wait:
+            return AsyncExecuteResult(board=self, return_code=None)
+        rc = await self._wait_complete()
+        return AsyncExecuteResult(board=self, return_code=int(rc))
+
+    async def macro(self, macro, args=''):
+        if args:
+            args = repr(args)
+        else:
+            args = ''
+        return await self.execute(MACROS[macro].format(args=args))
+
+    async def store_data(self, data, encoding=None):
+        """
+        Store file data in redis
+
+        Parameters
+        ----------
+        data : bytes
+            The file data
+
+        encoding : str, optional
+            Encoding to store the data with, the raw data is stored if the
+            encoding does not make it smaller.  Default None
+
+        Returns
+        -------
+        tuple
+            The redis key storing the data and the encoding used
+        """
+        file_key = 'file:' + hashlib.md5(data).hexdigest()
+        if encoding:
+            encoded_key = file_key + '.' + encoding
+            if await self.redis_db.exists(encoded_key):
+                return encoded_key, encoding
+            encoded = encode_data(data, encoding)
+            if len(encoded) < len(data):
+                await self.redis_db.set(encoded_key, encoded)
+                return encoded_key, encoding
+        if not await self.redis_db.exists(file_key):
+            await self.redis_db.set(file_key, data)
+        return file_key, None
+
+    async def send_file(self, file_key, encoding, dest, file_hash, ttl=3600, timeout=30):
+        """
+        Copy data already stored in redis to the board
+
+        Parameters
+        ----------
+        file_key : str
+            The redis key holding the data
+
+        encoding : str or None
+            The encoding the data is stored with
+
+        dest : str
+            The destination filename on the board
+
+        file_hash : str
+            The md5 of the file, recorded in the board manifest once the
+            copy succeeds
+
+        ttl : int, optional
+            How long the transaction is valid for in seconds, default=3600
+
+        timeout : int, optional
+            Number of seconds to wait for the copy to complete, default=30
+
+        Returns
+        -------
+        UploadResult
+            The result of the copy
+        """
+        args = ['transaction:' + self.name + ':', ttl, 'dest', dest, 'source', file_key]
+        if encoding:
+            args += ['encoding', encoding, 'wbits', COMPRESSION_WBITS]
+        create_transaction = self.redis_db.register_script(CREATE_TRANSACTION_SCRIPT)
+        transaction = await create_transaction(keys=['transaction_id:' + self.name], args=args)
+
+        pipeline = self.redis_db.pipeline(transaction=True)
+        pipeline.delete(self.complete_key)
+        pipeline.rpush(self.base_key + '.copy', transaction)
+        await pipeline.execute()
+        start = time.time()
+        print('Copying file to %s:%s' % (self.name, dest))
+        rc = await self._wait_complete(timeout=timeout, check_state=False)
+        latency = time.time() - start
+        if not copy_succeeded(rc):
+            return UploadResult(self, False, latency=latency)
+        await self.redis_db.hset(self.manifest_key, dest, file_hash)
+        return UploadResult(self, True, latency=latency)
+
+    async def upload(self, filename, dest, data=None, force=False, compress=False):
+        """
+        Upload a file to the board
+
+        Parameters
+        ----------
+        filename : str
+            The file to upload
+
+        dest : str
+            The destination filename on the board
+
+        data : bytes, optional
+            The file contents, if given they are uploaded instead of reading
+            the file
+
+        force : bool, optional
+            Transfer the file even if the board already has it,
+            default=False
+
+        compress : bool, optional
+            Transfer the file zlib compressed if the board supports it,
+            default=False
+
+        Returns
+        -------
+        UploadResult
+            The result of the upload
+        """
+        if data is None:
+            with open(filename, 'rb') as file_handle:
+                data = file_handle.read()
+        file_hash = hashlib.md5(data).hexdigest()
+        if not force and await self.redis_db.hget(self.manifest_key, dest) == file_hash.encode():
+            print('Skipping unchanged file %s:%s' % (self.name, dest))
+            return UploadResult(self, True, skipped=True)
+        encoding = None
+        if compress and await self.redis_db.sismember(self.capabilities_key, 'zlib'):
+            encoding = 'zlib'
+        file_key, encoding = await self.store_data(data, encoding=encoding)
+        return await self.send_file(file_key, encoding, dest, file_hash)
+
+
+class AsyncMicropythonBoards(object):
+    """
+    The boards managed by the cloudmanager, accessed with an asyncio redis
+    client.
+
+    Parameters
+    ----------
+    redis_db : redis.asyncio.Redis, optional
+        The asyncio redis client, default connects to the cloudmanager redis
+        server
+
+    publish_output : bool, optional
+        Publish the commands and output to the console streams of the boards
+
+    concurrency : int, optional
+        Default maximum number of boards to operate on at once, default=32
+    """
+    def __init__(self, redis_db=None, publish_output=None, concurrency=DEFAULT_CONCURRENCY):
+        self.server = None
+        self._sync_redis_db = None
+        self.redis_db = redis_db
+        if not self.redis_db:
+            self.redis_db, self.server = connect()
+        self.publish_output = publish_output
+        self.concurrency = concurrency
+        self.dispatcher = AsyncCompletionDispatcher(self.redis_db)
+
+    def _board(self, name):
+        return AsyncMicropythonBoard(
+            name, self.redis_db, dispatcher=self.dispatcher, publish_output=self.publish_output
+        )
+
+    @property
+    def sync_redis_db(self):
+        """
+        A synchronous connection to the same redis server, used to share the
+        registry code with MicropythonBoards
+        """
+        if not self._sync_redis_db:
+            self._sync_redis_db = self.server or sync_client(self.redis_db)
+        return self._sync_redis_db
+
+    async def registered_board_names(self, check_online=True):
+        """
+        Get the names of the boards in the registry
+
+        The registry is read with cloudmanager.registry.registered_board_names
+        in a worker thread, so it falls back to scanning for the boards the
+        same way.
+
+        Parameters
+        ----------
+        check_online : bool, optional
+            Only return the boards that are currently online, default=True
+
+        Returns
+        -------
+        list
+            The board names
+        """
+        return await asyncio.get_event_loop().run_in_executor(
+            None, functools.partial(registered_board_names, self.sync_redis_db, check_online=check_online)
+        )
+
+    async def snapshot(self, names=None):
+        """
+        Get the state and platform of boards using a single MGET
+
+        Parameters
+        ----------
+        names : list, optional
+            The names of the boards to get, default is all registered boards
+
+        Returns
+        -------
+        dict
+            Dictionary mapping the name of each board that is online to a
+            (state, platform) tuple
+        """
+        if names is None:
+            names = await self.registered_board_names(check_online=False)
+        names = list(names)
+        if not names:
+            return {}
+
+        values = await self.redis_db.mget(
+            ['board:' + name for name in names] + ['boardinfo:' + name for name in names]
+        )
+        snapshot = {}
+        for name, state, platform in zip(names, values[:len(names)], values[len(names):]):
+            if state is None:
+                continue
+            if isinstance(platform, bytes):
+                platform = platform.decode()
+                BOARDINFO_CACHE.set(name, platform)
+            snapshot[name] = (state.decode(), platform)
+        if snapshot:
+            await self.redis_db.zadd(BOARD_REGISTRY_KEY, {name: time.time() for name in snapshot.keys()})
+        return snapshot
+
+    async def all(self):
+        return [self._board(name) for name in sorted((await self.snapshot()).keys())]
+
+    async def get(self, name):
+        if await self.redis_db.exists('board:' + name):
+            await self.redis_db.zadd(BOARD_REGISTRY_KEY, {name: time.time()})
+            return self._board(name)
+        raise NoSuchBoard('No such board %r registered with this cloudmanager' % name)
+
+    async def filter(self, filter_platforms=None, filter_states=None, range=None):
+        boards = []
+        if not filter_platforms:
+            filter_platforms = []
+        if not filter_states:
+            filter_states = []
+        if not range:
+            range = []
+        range = set(hostlists.expand(range))
+        if range:
+            # Check the named boards directly, they may not have been added
+            # to the registry yet
+            names = range
+        else:
+            names = await self.registered_board_names(check_online=False)
+        for name, (state, platform) in sorted((await self.snapshot(names)).items()):
+            if filter_platforms and platform not in filter_platforms:
+                continue
+            if filter_states and state not in filter_states:
+                continue
+            boards.append(self._board(name))
+        return boards
+
+    async def _fan_out(self, boards, operation, concurrency=None):
+        """
+        Run an operation on boards concurrently and yield the results as
+        each board finishes.
+
+        Yields
+        ------
+        tuple
+            A (board, result, error) tuple in completion order
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency or len(boards) or 1)
+
+        async def run(board):
+            async with semaphore:
+                try:
+                    return board, await operation(board), None
+                except BoardNotResponding as error:
+                    return board, None, error
+
+        tasks = [asyncio.ensure_future(run(board)) for board in boards]
+        try:
+            for completed in asyncio.as_completed(tasks):
+                yield await completed
+        finally:
+            # Don't leave the remaining boards running when an error is
+            # raised or the caller stops early
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def execute(self, command, **kwargs):
+        filter_platforms = kwargs.get('platforms', None)
+        filter_states = kwargs.get('states', None)
+        range = kwargs.get('range', None)
+        concurrency = kwargs.get('concurrency', None)
+        boards = await self.filter(filter_platforms=filter_platforms, filter_states=filter_states, range=range)
+        async for board, result, error in self._fan_out(boards, lambda board: board.execute(command), concurrency):
+            if error:
+                raise error
+            yield result
+
+    async def macro(self, macro, **kwargs):
+        filter_platforms = kwargs.get('platforms', None)
+        filter_states = kwargs.get('states', None)
+        range = kwargs.get('range', None)
+        args = kwargs.get('args', '')
+        concurrency = kwargs.get('concurrency', None)
+        boards = await self.filter(filter_platforms=filter_platforms, filter_states=filter_states, range=range)
+        async for board, result, error in self._fan_out(boards, lambda board: board.macro(macro, args), concurrency):
+            if error:
+                print('Board %r is not responding' % board.name)
+                continue
+            yield result
+
+    async def upload(self, filename, dest, data=None, **kwargs):
+        """
+        Upload a file to the boards
+
+        The file is read, hashed and stored in redis once and then copied to
+        the boards concurrently.
+
+        Parameters
+        ----------
+        filename : str
+            The file to upload
+
+        dest : str
+            The destination filename on the boards
+
+        data : bytes, optional
+            The file contents, if given they are uploaded instead of reading
+            the file
+
+        Returns
+        -------
+        dict
+            Dictionary mapping each board name to an UploadResult
+        """
+        filter_platforms = kwargs.get('platforms', None)
+        filter_states = kwargs.get('states', None)
+        board_range = kwargs.get('range', None)
+        concurrency = kwargs.get('concurrency', None)
+        force = kwargs.get('force', False)
+        compress = kwargs.get('compress', False)
+        boards = await self.filter(
+            filter_platforms=filter_platforms, filter_states=filter_states, range=board_range
+        )
+        report = {}
+        if not boards:
+            return report
+
+        if data is None:
+            with open(filename, 'rb') as file_handle:
+                data = file_handle.read()
+        file_hash = hashlib.md5(data).hexdigest()
+        sources = {None: await boards[0].store_data(data)}
+        if compress:
+            sources['zlib'] = await boards[0].store_data(data, encoding='zlib')
+
+        async def copy(board):
+            if not force and await self.redis_db.hget(board.manifest_key, dest) == file_hash.encode():
+                print('Skipping unchanged file %s:%s' % (board.name, dest))
+                return UploadResult(board, True, skipped=True)
+            encoding = None
+            if compress and await self.redis_db.sismember(board.capabilities_key, 'zlib'):
+                encoding = 'zlib'
+            file_key, encoding = sources[encoding]
+            return await board.send_file(file_key, encoding, dest, file_hash)
+
+        async for board, result, error in self._fan_out(boards, copy, concurrency):
+            report[board.name] = result or UploadResult(board, False, error=error)
+        return report
+
+    async def close(self):
+        """
+        Close the redis connections
+        """
+        await self.redis_db.aclose()
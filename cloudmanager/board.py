@@ -1,161 +1,489 @@
 from __future__ import print_function
 import hashlib
-import hostlists
+import io
 import logging
-import multiprocessing
-import os
-import requests
-import shutil
-import subprocess
-import sys
-import tarfile
-import telnetlib
-import tempfile
 import time
-from .exceptions import BoardNotResponding, NoSuchBoard
-from .utility import connect_to_redis, header
+import zlib
+from .boardinfo import BOARDINFO_CACHE
+from .exceptions import BoardError, BoardNotResponding, NoSuchBoard
+from .fanout import CompletionDispatcher, DEFAULT_CONCURRENCY, fan_out
+from .macros import MACROS
+from .mpy import can_compile, compile_mpy, mpy_file_version
+from .registry import register_boards, registered_board_names
+from .utility import connect_to_redis
 
 
 LOG = logging.getLogger(__name__)
 
-MACROS = {
-    'echo': """print({args})
-""",
-    'reset': """import machine
-print('resetting{args}')
-machine.reset()
-
-""",
-    'ls': """import os
-for line in os.listdir({args}):
-    print(line.strip())
-
-""",
-    'mkdir': """import os
-os.mkdir({args})
-
-""",
-    'rmdir': """import os
-os.rmdir({args})
-
-""",
-    'mem_free': """import gc
-gc.collect()
-print(gc.mem_free())
-
-""",
-    'set': """from bootconfig.config import set
-key, value={args}.split('=')
-set(key, value)
-
-""",
-    'settings': """from bootconfig.config import list_settings
-list_settings()
-""",
-    'uname': """import os
-print(os.uname())
+# Seconds to wait for a command run through the raw REPL of a board
+RAW_REPL_TIMEOUT = 300
 
+# Prints the mpy version the firmware of a board can load, 0 if it can't
+# load .mpy files
+MPY_VERSION_COMMAND = """import sys
+print(getattr(sys.implementation, '_mpy', 0) & 0xff)
 """
-}
+
+# Seconds the mpy version reported by a board is cached for, so a firmware
+# update is noticed
+MPY_VERSION_TTL = 86400
+
+# Removes the source of a compiled file from a board, it fails without
+# removing anything if the firmware can't load the mpy version uploaded
+REMOVE_COMPILED_SOURCE = """import os, sys
+if getattr(sys.implementation, '_mpy', 0) & 0xff != {version}:
+    raise ImportError('mpy version {version} is not supported')
+os.remove({dest!r})
+"""
+
+
+# Allocate a transaction id and store the transaction fields in a single
+# round trip
+CREATE_TRANSACTION_SCRIPT = """
+local transaction_key = ARGV[1] .. redis.call('INCR', KEYS[1])
+for i = 3, #ARGV, 2 do
+    redis.call('HSET', transaction_key, ARGV[i], ARGV[i + 1])
+end
+if tonumber(ARGV[2]) > 0 then
+    redis.call('EXPIRE', transaction_key, ARGV[2])
+end
+return transaction_key
+"""
+
+# Chunk size for chunked file transfers, small enough for esp8266 boards
+DEFAULT_CHUNK_SIZE = 1024
+
+# Window size used when compressing file data, boards need a buffer of
+# 2**COMPRESSION_WBITS bytes to decompress it
+COMPRESSION_WBITS = 10
+
+# Maximum number of entries kept in a board's console output stream
+CONSOLE_STREAM_MAXLEN = 1000
+
+
+def file_md5(filename):
+    """
+    Compute the md5 hash of a file without reading it all into memory
+
+    Parameters
+    ----------
+    filename : str
+        The file to hash
+
+    Returns
+    -------
+    str
+        The hex md5 digest
+    """
+    file_hash = hashlib.md5()
+    with open(filename, 'rb') as file_handle:
+        for data in iter(lambda: file_handle.read(65536), b''):
+            file_hash.update(data)
+    return file_hash.hexdigest()
+
+
+def encode_data(data, encoding=None):
+    """
+    Encode file data for transfer to a board
+
+    Parameters
+    ----------
+    data : bytes
+        The data to encode
+
+    encoding : str, optional
+        The encoding to use, zlib or None for the raw data
+
+    Returns
+    -------
+    bytes
+        The encoded data
+    """
+    if encoding == 'zlib':
+        compressor = zlib.compressobj(9, zlib.DEFLATED, COMPRESSION_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    return data
+
+
+def chunked_transaction_fields(file_hash, chunk_hashes, chunk_size, encoding=None):
+    """
+    Get the transaction fields describing a chunked file transfer
+
+    Parameters
+    ----------
+    file_hash : str
+        The md5 of the whole file
+
+    chunk_hashes : list
+        The md5 of each chunk
+
+    chunk_size : int
+        The size of each chunk in bytes
+
+    encoding : str, optional
+        The encoding the chunks are stored with, default None
+
+    Returns
+    -------
+    dict
+        The transaction fields
+    """
+    fields = {
+        'md5': file_hash,
+        'chunks': len(chunk_hashes),
+        'chunk_size': chunk_size,
+        'acked': -1,
+        'encoding': encoding or '',
+    }
+    if encoding:
+        fields['wbits'] = COMPRESSION_WBITS
+    for index, chunk_hash in enumerate(chunk_hashes):
+        fields['chunk:%d' % index] = chunk_hash
+    return fields
+
+
+def copy_succeeded(rc):
+    """
+    Check the value a board pushed to its complete key after a copy
+
+    Parameters
+    ----------
+    rc : bytes or None
+        The value from the complete key, None if the copy did not complete
+
+    Returns
+    -------
+    bool
+        True if the copy completed successfully
+    """
+    if rc is None:
+        return False
+    try:
+        return int(rc) == 0
+    except ValueError:
+        return True
+
+
+class ConsoleStream(object):
+    """
+    A capped redis stream holding the console output of a board
+
+    Each entry has a type field of command, output or complete and a data
+    field holding the command, the output chunk or the return code.  Any
+    number of readers can follow the stream from their own last id without
+    re-reading the output they have already seen.
+    """
+    def __init__(self, board, last_id='$', maxlen=CONSOLE_STREAM_MAXLEN):
+        self.board = board
+        self.last_id = last_id
+        self.maxlen = maxlen
+
+    def publish(self, entry_type, data, redis_db=None):
+        """
+        Add an entry to the stream
+
+        Parameters
+        ----------
+        entry_type : str
+            The type of entry, one of command, output or complete
+
+        data : bytes or str
+            The entry data
+
+        redis_db : redis.Redis, optional
+            The redis connection or pipeline to use, default is the board's
+            connection
+        """
+        if redis_db is None:
+            redis_db = self.board.redis_db
+        redis_db.xadd(
+            self.board.output_stream_key, {'type': entry_type, 'data': data}, maxlen=self.maxlen, approximate=True
+        )
+
+    def read(self, block=1000, count=100):
+        """
+        Read the entries added since the last read
+
+        Parameters
+        ----------
+        block : int, optional
+            Milliseconds to wait for new entries, default=1000
+
+        count : int, optional
+            Maximum number of entries to return, default=100
+
+        Returns
+        -------
+        list
+            List of (entry_type, data) tuples
+        """
+        if self.last_id == '$':
+            # Follow from the current last entry, re-sending $ would skip
+            # entries added between two reads
+            last_entries = self.board.redis_db.xrevrange(self.board.output_stream_key, count=1)
+            self.last_id = last_entries[0][0] if last_entries else '0-0'
+        entries = []
+        response = self.board.redis_db.xread({self.board.output_stream_key: self.last_id}, count=count, block=block)
+        for stream_key, stream_entries in response or []:
+            for entry_id, fields in stream_entries:
+                self.last_id = entry_id
+                entries.append((fields[b'type'].decode(), fields[b'data']))
+        return entries
+
+    def __iter__(self):
+        while True:
+            for entry in self.read():
+                yield entry
 
 
 class ExecuteResult(object):
+    """
+    The output of a command run on a board
+
+    Iterating over the result yields the output in chunks as the board
+    produces it, until the command completes.
+    """
+    chunk_size = 1024
+    poll_interval = .1
+    state_check_interval = 1
+
     def __init__(self, board, return_code=0):
         self.board = board
         self.position = 0
         self.return_code = return_code
+        self._last_state_check = time.time()
+        self._complete_published = False
+
+    def _publish(self, entry_type, data):
+        if self.board.publish_output:
+            ConsoleStream(self.board).publish(entry_type, data)
+
+    def _publish_complete(self):
+        if self.return_code is None or self._complete_published:
+            return
+        self._complete_published = True
+        self._publish('complete', self.return_code)
 
     def read(self, num_bytes=-1):
-        result = self.board.redis_db.getrange(self.board.stdout_key, self.position, num_bytes)
-        if num_bytes > 0 and len(result) < num_bytes:
-            self.position += len(result)
+        """
+        Read output from the current position
+
+        Parameters
+        ----------
+        num_bytes : int, optional
+            Maximum number of bytes to read, default -1 reads all of the
+            output currently available
+
+        Returns
+        -------
+        bytes
+            The output
+        """
+        if num_bytes == 0:
+            return b''
+        end = -1
+        if num_bytes > 0:
+            end = self.position + num_bytes - 1
+        result = self.board.redis_db.getrange(self.board.stdout_key, self.position, end)
+        self.position += len(result)
+        if result:
+            self._publish('output', result)
+        if num_bytes < 0:
+            self._publish_complete()
         return result
 
+    def _poll_complete(self):
+        """
+        Check if the command has completed, waiting up to poll_interval
+        seconds if it has not.
+        """
+        rc = self.board.redis_db.lpop(self.board.complete_key)
+        if rc is not None:
+            self.return_code = int(rc)
+            return
+        if time.time() - self._last_state_check < self.state_check_interval:
+            time.sleep(self.poll_interval)
+            return
+        self._last_state_check = time.time()
+        state = self.board.state
+        if not state or state in ['idle']:
+            # Check again in case the board completed before going idle
+            rc = self.board.redis_db.lpop(self.board.complete_key)
+            if rc is None:
+                raise BoardNotResponding('Board {0} is not responding\n'.format(self.board.name))
+            self.return_code = int(rc)
+            return
+        time.sleep(self.poll_interval)
+
+    def __iter__(self):
+        while True:
+            output = self.read(self.chunk_size)
+            if output:
+                yield output
+                continue
+            if self.return_code is not None:
+                self._publish_complete()
+                return
+            self._poll_complete()
+
 
 class ExecuteResultTelnet(ExecuteResult):
+    """
+    The result of a command on a board that returns its output over telnet
+
+    The authenticated telnet session is taken from the per process session
+    pool and is returned to it once the output has been read or close() is
+    called.  Iterating over the result yields the output until the command
+    completes, the completion is read from the complete key of the board.
+    """
     username='micro'
     password='python'
     hostname='192.168.1.1'
     _tn = None
     def __init__(self, board, **kwargs):
+        # Imported here so the telnet module is only loaded for boards that use it
+        from .telnet import SESSION_POOL
+
         self.username = kwargs.get('username', self.username)
         self.password = kwargs.get('password', self.password)
-        self.hostname = kwargs.get('hostname', self.hostname)
-        self._tn = self._get_authenticated_connection(
-            hostname=self.hostname, username=self.username, password=self.password
-        )
+        self.hostname = kwargs.get('hostname') or self.hostname
+        self._pool = SESSION_POOL
+        self._tn = self._pool.get(self.hostname, username=self.username, password=self.password)
         super(ExecuteResultTelnet, self).__init__(board, return_code=kwargs.get('return_code', None))
 
-    def _echo_output(self, output, echo=False):
+    def close(self):
+        """
+        Return the telnet session to the session pool
         """
-        Print output if echo is True
+        if self._tn:
+            self._pool.release(self._tn, username=self.username, password=self.password)
+            self._tn = None
 
-        Parameters
-        ----------
-        output : str
-            The output to echo
+    def __del__(self):
+        self.close()
 
-        echo : bool
-            Flag to indicate if the output should be displayed.
-            Default: False
-        """
-        if not echo:
-            return
-        print(output, end='')
+    def read(self, num_bytes=-1):
+        if not self._tn:
+            return b''
+        return self._tn.read_very_eager()
 
-    def _get_authenticated_connection(self, echo=False, hostname='192.168.1.1', username='micro', password='python'):
-        """
-        Get a telnet connection to the wipy and authenticate
-        with the username and password from the settings.
+    def __iter__(self):
+        while self._tn:
+            output = self.read()
+            if output:
+                yield output
+                continue
+            if self.return_code is not None:
+                break
+            self._poll_complete()
+        self.close()
 
-        Parameters
-        ----------
-        echo : bool
-            Echo connection output.  Default=False
 
-        hostname : str,optional
-            The hostname or IP address to connect to.  If not provided
-            will use the value from the sttings.
+class ExecuteResultRawRepl(ExecuteResult):
+    """
+    The result of a command run through the raw REPL of a board over telnet
 
-        Returns
-        -------
-        telnetlib.Telnet
-            Returns a telnetlib.Telnet connection object
-        """
-        tn = telnetlib.Telnet()
-        tn.open(hostname)
-        self._echo_output(tn.read_until(b"Login as: ", timeout=2).decode(), echo)
-        time.sleep(.5)
-        tn.write(username.encode() + b'\r')
-        self._echo_output(tn.read_until(b'assword: ', timeout=2).decode(), echo)
-        time.sleep(.5)
-        tn.write(password.encode() + b'\r')
-        self._echo_output(tn.read_until(b'>>> ', timeout=2).decode(), echo)
-        self._echo_output(tn.read_very_eager().decode(), echo)
-        return tn
+    The command has completed when the result is created.  Iterating over
+    the result yields the stdout of the command followed by its stderr.
+
+    Parameters
+    ----------
+    board : MicropythonBoard
+        The board the command ran on
+
+    stdout : bytes
+        The output of the command
+
+    stderr : bytes
+        The error output of the command, the traceback if it raised an
+        exception
+    """
+    def __init__(self, board, stdout, stderr):
+        super(ExecuteResultRawRepl, self).__init__(board, return_code=1 if stderr else 0)
+        self.stdout = stdout
+        self.stderr = stderr
+        self._output = stdout + stderr
 
     def read(self, num_bytes=-1):
-        return self._tn.read_very_eager()
+        end = len(self._output) if num_bytes < 0 else self.position + num_bytes
+        result = self._output[self.position:end]
+        self.position += len(result)
+        if result:
+            self._publish('output', result)
+        if num_bytes < 0:
+            self._publish_complete()
+        return result
+
+    def __iter__(self):
+        while True:
+            output = self.read(self.chunk_size)
+            if not output:
+                self._publish_complete()
+                return
+            yield output
+
+
+class UploadResult(object):
+    """
+    The result of uploading a file to a board
+
+    Parameters
+    ----------
+    board : MicropythonBoard
+        The board the file was uploaded to
+
+    success : bool
+        True if the board has the file
+
+    latency : float, optional
+        Number of seconds from sending the copy to the board until it
+        completed, None if the file was not sent
+
+    skipped : bool, optional
+        True if the file was not sent because the board already had it
+
+    error : Exception, optional
+        The exception raised while waiting for the board
+    """
+    def __init__(self, board, success, latency=None, skipped=False, error=None):
+        self.board = board
+        self.success = success
+        self.latency = latency
+        self.skipped = skipped
+        self.error = error
+
+    def __repr__(self):
+        return '<UploadResult %s success=%r latency=%r skipped=%r>' % (
+            self.board.name, self.success, self.latency, self.skipped
+        )
 
 
 class MicropythonBoard(object):
     name = None
     platform = None
+    publish_output = False
 
-    def __init__(self, name=None, redis_db=None):
+    def __init__(self, name=None, redis_db=None, dispatcher=None, publish_output=None):
         if isinstance(name, bytes):
             name = name.decode()
         self.name = name
         self.redis_db = redis_db
         if not redis_db:
             self.redis_db = connect_to_redis()
+        self.dispatcher = dispatcher
+        if publish_output is not None:
+            self.publish_output = publish_output
         self.base_key = 'repl:' + self.name
         self.status_key = 'board:' + self.name
         self.console_key = self.base_key + '.console'
         self.stdout_key = self.console_key + '.stdout'
+        self.output_stream_key = self.console_key + '.stream'
         self.complete_key = self.base_key + '.complete'
         self.boardinfo_key = 'boardinfo:' + self.name
         self.copied_key = self.base_key + '.copied'
+        self.manifest_key = 'manifest:' + self.name
+        self.capabilities_key = 'boardcaps:' + self.name
+        self.mpy_version_key = 'mpyversion:' + self.name
 
         super(MicropythonBoard, self).__init__()
 
@@ -179,7 +507,15 @@ class MicropythonBoard(object):
 
     @property
     def platform(self):
-        return self.redis_db.get(self.boardinfo_key).decode()
+        """
+        Get the platform of the board, the value is cached for the process
+
+        Returns
+        -------
+        str
+            The board platform
+        """
+        return BOARDINFO_CACHE.get(self.redis_db, self.name)
 
     def send_command(self, command, argument):
         command_key = self.base_key + '.' + command
@@ -189,8 +525,10 @@ class MicropythonBoard(object):
         key = self.base_key + '.rename'
         self.redis_db.rpush(key, name)
         self.redis_db.expire(key, 30)
+        BOARDINFO_CACHE.invalidate(self.name)
+        BOARDINFO_CACHE.invalidate(name)
 
-    def create_file_transaction(self, file_key, dest, ttl=3600):
+    def create_file_transaction(self, file_key, dest, ttl=3600, fields=None, client=None):
         """
         Create a file transfer transaction
 
@@ -199,74 +537,293 @@ class MicropythonBoard(object):
         board: str
             The board to create the transaction for
         file_key: str
-            The redis key that holds the data to be transferred
+            The redis key that holds the data to be transferred, None for
+            chunked transfers
         dest : str
             The destination filename to store the data
         ttl: int, optional
             How long the transaction is valid for in seconds.
             A value of 0 will never expire default=3600
+        fields: dict, optional
+            Additional fields to store in the transaction
+        client: redis.client.Pipeline, optional
+            Queue the transaction creation in this pipeline, the transaction
+            key is returned by the pipeline execute() instead
 
         Returns
         -------
         str
             The redis key holding the transaction
         """
-        # Create a unique transaction key
-        transaction_count_key = 'transaction_id:' + self.name
-        transaction_id = self.redis_db.incr(transaction_count_key)
-        transaction_key = "transaction:" + self.name + ':' + str(transaction_id)
+        transaction_fields = {'dest': dest}
+        if file_key:
+            transaction_fields['source'] = file_key
+        transaction_fields.update(fields or {})
+        args = ['transaction:' + self.name + ':', ttl or 0]
+        for field, value in transaction_fields.items():
+            args += [field, value]
 
-        # Store the arguments in the transaction key
-        self.redis_db.hset(transaction_key, 'source', file_key)
-        self.redis_db.hset(transaction_key, 'dest', dest)
+        transaction_count_key = 'transaction_id:' + self.name
+        create_transaction = self.redis_db.register_script(CREATE_TRANSACTION_SCRIPT)
+        if client is not None:
+            return create_transaction(keys=[transaction_count_key], args=args, client=client)
+        transaction_key = create_transaction(keys=[transaction_count_key], args=args)
+        if isinstance(transaction_key, bytes):
+            transaction_key = transaction_key.decode()
+        return transaction_key
 
-        # If a ttl was specified set the expire time
-        if ttl:
-            self.redis_db.expire(transaction_key, ttl)
+    def start_execute(self, command):
+        """
+        Send a command to the board without waiting for it to complete
 
-        # Return the transaction key
-        return transaction_key
+        Parameters
+        ----------
+        command : str
+            The python code to execute on the board
 
-    def execute(self, command):
+        Returns
+        -------
+        ExecuteResultTelnet or None
+            The telnet result object for boards that return their output
+            over telnet, otherwise None
+        """
         command_key = self.base_key + '.command'
 
-        self.redis_db.delete(self.stdout_key)
-        self.redis_db.delete(self.complete_key)
-
-        if self.platform.lower() in ['wipy']:
+        telnet_results = None
+        if (self.platform or '').lower() in ['wipy']:
             hostname = self.redis_db.get(self.console_key)
             telnet_results = ExecuteResultTelnet(board=self, hostname=hostname)
 
-        self.redis_db.rpush(command_key, command)
-        self.redis_db.expire(command_key, 10)
-        self.redis_db.expire(self.status_key, 10)
+        # Clear the previous output and queue the command atomically so the
+        # board can't pick up the command before the old output is removed.
+        pipeline = self.redis_db.pipeline(transaction=True)
+        pipeline.delete(self.stdout_key, self.complete_key)
+        pipeline.rpush(command_key, command)
+        pipeline.expire(command_key, 10)
+        pipeline.expire(self.status_key, 10)
+        if self.publish_output:
+            ConsoleStream(self).publish('command', command, redis_db=pipeline)
+        pipeline.execute()
+        return telnet_results
+
+    def _wait_complete(self, timeout=None, check_state=True):
+        """
+        Wait for the board to push a value to the complete key
+
+        Parameters
+        ----------
+        timeout : int, optional
+            Number of seconds to wait, default None waits until the board
+            completes or stops responding
 
+        check_state : bool, optional
+            Raise BoardNotResponding if the board goes idle or away while
+            waiting, default=True
 
-        rc = None
-        while rc is None:
+        Returns
+        -------
+        bytes or None
+            The value from the complete key or None if the timeout expired
+        """
+        if self.dispatcher:
+            return self.dispatcher.wait(self, timeout=timeout, check_state=check_state)
+
+        start = time.time()
+        while True:
             rc = self.redis_db.blpop(self.complete_key, timeout=1)
             if rc is not None:
-                rc = int(rc[1])
-                break
+                return rc[1]
 
-            if not self.state or self.state in ['idle']:
+            state = self.state if check_state else None
+            if check_state and (not state or state in ['idle']):
                 raise BoardNotResponding('Board {0} is not responding\n'.format(self.name))
 
-        if self.platform.lower() in ['wipy']:
+            if timeout and time.time() - start >= timeout:
+                return
+
+    def wait_for_completion(self):
+        """
+        Wait for the command running on the board to complete
+
+        Returns
+        -------
+        int
+            The return code of the command
+
+        Raises
+        ------
+        BoardNotResponding
+            The board stopped responding before the command completed
+        """
+        return int(self._wait_complete())
+
+    def execute(self, command, wait=True, raw_repl=False):
+        """
+        Execute a command on the board
+
+        Parameters
+        ----------
+        command : str
+            The python code to execute on the board
+
+        wait : bool, optional
+            Wait for the command to complete before returning, default=True.
+            If False the result is returned as soon as the command is sent
+            and iterating over it streams the output as the board runs.
+
+        raw_repl : bool, optional
+            Run the command through the raw REPL of the board over telnet
+            instead of sending it to the board through the server,
+            default=False.  Boards without a telnet console run the command
+            through the server.
+
+        Returns
+        -------
+        ExecuteResult
+            The result of the command
+        """
+        if raw_repl:
+            hostname = self.redis_db.get(self.console_key)
+            if hostname:
+                return self.execute_raw_repl(command, hostname=hostname)
+            LOG.debug('Board %r does not have a telnet console, executing through the server', self.name)
+
+        telnet_results = self.start_execute(command)
+        if not wait:
+            if telnet_results:
+                return telnet_results
+            return ExecuteResult(board=self, return_code=None)
+
+        rc = self.wait_for_completion()
+
+        if telnet_results:
             telnet_results.return_code = rc
             return telnet_results
         return ExecuteResult(board=self, return_code=rc)
 
-    def macro(self, macro, args=''):
+    def execute_raw_repl(self, command, hostname=None, timeout=RAW_REPL_TIMEOUT):
+        """
+        Execute a command through the raw REPL of the board over telnet
+
+        The whole command is sent in one write, using raw-paste mode if the
+        board supports it, so multi-line scripts don't depend on the
+        indentation handling of the friendly REPL.
+
+        Parameters
+        ----------
+        command : str
+            The python code to execute on the board
+
+        hostname : str, optional
+            The hostname of the telnet console, default is the console of
+            the board
+
+        timeout : float, optional
+            Seconds to wait for the command to complete, default=300
+
+        Returns
+        -------
+        ExecuteResultRawRepl
+            The result of the command
+
+        Raises
+        ------
+        BoardNotResponding
+            The command did not complete within the timeout
+        """
+        # Imported here so the telnet module is only loaded for boards that use it
+        from .telnet import execute
+
+        if not hostname:
+            hostname = self.redis_db.get(self.console_key)
+        if not hostname:
+            raise BoardError('Board {0} does not have a telnet console'.format(self.name))
+        stdout, stderr = execute(command, hostname=hostname, timeout=timeout)
+        return ExecuteResultRawRepl(board=self, stdout=stdout, stderr=stderr)
+
+    def macro(self, macro, args='', raw_repl=False):
         if args:
             args = repr(args)
         else:
             args = ''
         # print('Executing macro %r with args %s:' % (macro, args))
         # print(MACROS[macro].format(args=args))
-        return self.execute(MACROS[macro].format(args=args))
+        return self.execute(MACROS[macro].format(args=args), raw_repl=raw_repl)
+
+    def supports(self, capability):
+        """
+        Check if the board has advertised a capability in its
+        boardcaps:<name> set, for example the zlib encoding.
+
+        Parameters
+        ----------
+        capability : str
+            The capability to check for
+
+        Returns
+        -------
+        bool
+            True if the board supports the capability
+        """
+        return bool(self.redis_db.sismember(self.capabilities_key, capability))
+
+    def mpy_version(self):
+        """
+        Get the mpy version of the compiled files the firmware of the board
+        can load.  The version is asked from the board the first time and
+        cached for MPY_VERSION_TTL seconds.
+
+        Returns
+        -------
+        int or None
+            The mpy version, 0 if the board can't load compiled files and
+            None if the board did not report it
+        """
+        version = self.redis_db.get(self.mpy_version_key)
+        if version is None:
+            result = self.execute(MPY_VERSION_COMMAND)
+            output = result.read().strip().splitlines()
+            if result.return_code or not output or not output[-1].strip().isdigit():
+                return
+            version = output[-1].strip()
+            self.redis_db.set(self.mpy_version_key, version, ex=MPY_VERSION_TTL)
+        return int(version)
+
+    def store_data(self, data, encoding=None):
+        """
+        Store file data in redis
+
+        Parameters
+        ----------
+        data : bytes
+            The file data
+
+        encoding : str, optional
+            Encoding to store the data with, the raw data is stored if the
+            encoding does not make it smaller.  Default None
+
+        Returns
+        -------
+        tuple
+            The redis key storing the data and the encoding used
+        """
+        hash = hashlib.md5(data).hexdigest()
 
-    def upload_to_redis(self, filename):
+        # Compute the key to store the data
+        file_key = 'file:' + hash
+        if encoding:
+            encoded_key = file_key + '.' + encoding
+            if self.redis_db.exists(encoded_key):
+                return encoded_key, encoding
+            encoded = encode_data(data, encoding)
+            if len(encoded) < len(data):
+                self.redis_db.set(encoded_key, encoded)
+                return encoded_key, encoding
+        if not self.redis_db.exists(file_key):
+            self.redis_db.set(file_key, data)
+        return file_key, None
+
+    def upload_to_redis(self, filename, encoding=None):
         """
         Upload file data to redis
 
@@ -275,6 +832,9 @@ class MicropythonBoard(object):
         filename : str
             The filename to upload
 
+        encoding : str, optional
+            Encoding to store the data with, default None
+
         Returns
         -------
         str
@@ -282,42 +842,321 @@ class MicropythonBoard(object):
         """
         with open(filename, 'rb') as file_handle:
             data = file_handle.read()
+        return self.store_data(data, encoding=encoding)[0]
 
-        hash = hashlib.md5(data).hexdigest()
+    def upload_chunks_to_redis(self, filename, chunk_size=DEFAULT_CHUNK_SIZE, ttl=3600, encoding=None, data=None):
+        """
+        Upload file data to redis as fixed size chunks without reading the
+        whole file into memory.
 
-        # Compute the key to store the data
-        file_key = 'file:' + hash
-        if not self.redis_db.exists(file_key):
-            self.redis_db.set(file_key, data)
-        return file_key
+        Each chunk is stored in a chunk:<md5 of the chunk> key, with a
+        .<encoding> suffix if an encoding is used.
+
+        Parameters
+        ----------
+        filename : str
+            The filename to upload
+
+        chunk_size : int, optional
+            The size of each chunk in bytes, default=1024
+
+        ttl : int, optional
+            How long the chunks are kept in seconds, default=3600
+
+        encoding : str, optional
+            Encoding to store each chunk with, default None
+
+        data : bytes, optional
+            The file contents, if given they are uploaded instead of reading
+            the file
+
+        Returns
+        -------
+        tuple
+            The md5 hash of the whole file and a list of the md5 hash of
+            each chunk
+        """
+        suffix = ''
+        if encoding:
+            suffix = '.' + encoding
+        file_hash = hashlib.md5()
+        chunk_hashes = []
+        pipeline = self.redis_db.pipeline(transaction=False)
+        file_handle = io.BytesIO(data) if data is not None else open(filename, 'rb')
+        with file_handle:
+            for chunk in iter(lambda: file_handle.read(chunk_size), b''):
+                file_hash.update(chunk)
+                chunk_hash = hashlib.md5(chunk).hexdigest()
+                chunk_hashes.append(chunk_hash)
+                pipeline.set('chunk:' + chunk_hash + suffix, encode_data(chunk, encoding), ex=ttl)
+                if len(pipeline) >= 64:
+                    pipeline.execute()
+        pipeline.execute()
+        return file_hash.hexdigest(), chunk_hashes
+
+    def create_chunked_transaction(self, filename, dest, chunk_size=DEFAULT_CHUNK_SIZE, ttl=3600, encoding=None,
+                                   data=None):
+        """
+        Create a chunked file transfer transaction, or return the pending
+        transaction for the same file and destination so the board can
+        resume it.
+
+        The transaction hash holds the dest, the md5 of the file, the
+        number of chunks, the chunk_size and a chunk:<index> field with the
+        md5 of each chunk.  The board fetches the chunk:<md5> keys in order
+        and records the index of each chunk it has written in the acked
+        field, so an interrupted transfer resumes from the chunk after
+        acked.  If an encoding is used it is stored in the encoding field
+        and the chunks are stored in chunk:<md5>.<encoding> keys.
+
+        Parameters
+        ----------
+        filename : str
+            The file to transfer
+
+        dest : str
+            The destination filename on the board
+
+        chunk_size : int, optional
+            The size of each chunk in bytes, default=1024
+
+        ttl : int, optional
+            How long the transaction is valid for in seconds, default=3600
 
-    def upload(self, filename, dest):
-        file_key = self.upload_to_redis(filename)
-        transaction = self.create_file_transaction(file_key=file_key, dest=dest)
-        self.redis_db.delete(self.complete_key)
-        self.send_command('copy', transaction)
+        encoding : str, optional
+            Encoding to store the chunks with, default None
+
+        data : bytes, optional
+            The file contents, if given they are transferred instead of
+            reading the file
+
+        Returns
+        -------
+        str
+            The redis key holding the transaction
+        """
+        file_hash, chunk_hashes = self.upload_chunks_to_redis(
+            filename, chunk_size=chunk_size, ttl=ttl, encoding=encoding, data=data
+        )
+
+        transfer_key = 'transfer:' + self.name + ':' + dest
+        pending = self.redis_db.get(transfer_key)
+        if pending:
+            pending = pending.decode()
+            pending_hash, pending_encoding = self.redis_db.hmget(pending, 'md5', 'encoding')
+            if pending_hash == file_hash.encode() and pending_encoding == (encoding or '').encode():
+                return pending
+
+        fields = chunked_transaction_fields(file_hash, chunk_hashes, chunk_size, encoding=encoding)
+        transaction = self.create_file_transaction(file_key=None, dest=dest, ttl=ttl, fields=fields)
+        self.redis_db.set(transfer_key, transaction, ex=ttl)
+        return transaction
+
+    def forget(self, dest=None):
+        """
+        Remove files from the manifest of the files on the board, so they
+        are transferred by the next upload.
+
+        Parameters
+        ----------
+        dest : str, optional
+            The filename on the board, default removes all files
+        """
+        if dest:
+            self.redis_db.hdel(self.manifest_key, dest)
+        else:
+            self.redis_db.delete(self.manifest_key)
+
+    def upload(self, filename, dest, chunk_size=None, force=False, compress=False, data=None):
+        """
+        Upload a file to the board
+
+        The md5 of each file copied to the board is recorded in the
+        manifest:<name> hash, files the board already has are skipped.
+
+        Parameters
+        ----------
+        filename : str
+            The file to upload
+
+        dest : str
+            The destination filename on the board
+
+        chunk_size : int, optional
+            Transfer the file in chunks of this many bytes, default None
+            transfers the whole file at once
+
+        force : bool, optional
+            Transfer the file even if the board already has it,
+            default=False
+
+        compress : bool, optional
+            Transfer the file zlib compressed if the board supports it,
+            default=False
+
+        data : bytes, optional
+            The file contents, if given they are uploaded instead of reading
+            the file
+
+        Returns
+        -------
+        bool
+            True if the file was transferred, False if it was skipped or
+            the copy did not complete
+        """
+        if data is None:
+            file_hash = file_md5(filename)
+        else:
+            file_hash = hashlib.md5(data).hexdigest()
+        if not force and self.redis_db.hget(self.manifest_key, dest) == file_hash.encode():
+            print('Skipping unchanged file %s:%s' % (self.name, dest))
+            return False
+
+        encoding = None
+        if compress and self.supports('zlib'):
+            encoding = 'zlib'
+
+        if chunk_size:
+            transaction = self.create_chunked_transaction(
+                filename, dest, chunk_size=chunk_size, encoding=encoding, data=data
+            )
+        else:
+            if data is None:
+                with open(filename, 'rb') as file_handle:
+                    data = file_handle.read()
+            file_key, encoding = self.store_data(data, encoding=encoding)
+            fields = {}
+            if encoding:
+                fields = {'encoding': encoding, 'wbits': COMPRESSION_WBITS}
+            transaction = self.create_file_transaction(file_key=file_key, dest=dest, fields=fields)
+        pipeline = self.redis_db.pipeline(transaction=True)
+        pipeline.delete(self.complete_key)
+        pipeline.rpush(self.base_key + '.copy', transaction)
+        pipeline.execute()
 
         print('Copying file to %s:%s' % (self.name, dest))
-        rc = self.redis_db.blpop(self.complete_key, timeout=30)
+        rc = self.wait_for_copy(transaction, dest, chunked=bool(chunk_size))
+        if not copy_succeeded(rc):
+            return False
+        self.redis_db.hset(self.manifest_key, dest, file_hash)
+        return True
+
+    def wait_for_copy(self, transaction, dest, chunked=False, timeout=30):
+        """
+        Wait for the board to complete a file copy transaction
+
+        Parameters
+        ----------
+        transaction : str
+            The redis key holding the transaction
+
+        dest : str
+            The destination filename on the board
+
+        chunked : bool, optional
+            The transaction is a chunked transfer, the wait is extended as
+            long as the board keeps acknowledging chunks, default=False
+
+        timeout : int, optional
+            Number of seconds to wait for the board to make progress,
+            default=30
+
+        Returns
+        -------
+        bytes or None
+            The value the board pushed to the complete key, None if it did
+            not complete
+        """
+        # Start from the chunks already acknowledged when the wait began, so
+        # a board that never acknowledges another chunk isn't seen as making
+        # progress
+        acked = None
+        if chunked:
+            acked = self.redis_db.hget(transaction, 'acked')
+        while True:
+            rc = self._wait_complete(timeout=timeout, check_state=False)
+            if rc is not None or not chunked:
+                break
+            # Keep waiting as long as the board is making progress
+            progress = self.redis_db.hget(transaction, 'acked')
+            if progress is None or progress == acked:
+                break
+            acked = progress
+        if rc is not None and chunked:
+            self.redis_db.delete('transfer:' + self.name + ':' + dest)
+        return rc
 
 
 class MicropythonBoards(object):
-    def __init__(self, redis_db=None):
+    def __init__(self, redis_db=None, publish_output=None, package_cache=None):
         self.redis_db = redis_db
         if not self.redis_db:
             self.redis_db = connect_to_redis()
+        self.dispatcher = CompletionDispatcher(self.redis_db)
+        self.publish_output = publish_output
+        self._package_cache = package_cache
         self.installed_packages = []
 
+    @property
+    def package_cache(self):
+        """
+        The cache of package metadata and source distributions used by
+        install()
+        """
+        if not self._package_cache:
+            from .package_cache import PackageCache
+
+            self._package_cache = PackageCache()
+        return self._package_cache
+
+    def _board(self, name):
+        return MicropythonBoard(
+            name, redis_db=self.redis_db, dispatcher=self.dispatcher, publish_output=self.publish_output
+        )
+
+    def snapshot(self, names=None):
+        """
+        Get the state and platform of boards using a single MGET
+
+        Parameters
+        ----------
+        names : list, optional
+            The names of the boards to get, default is all registered boards
+
+        Returns
+        -------
+        dict
+            Dictionary mapping the name of each board that is online to a
+            (state, platform) tuple
+        """
+        if names is None:
+            names = registered_board_names(self.redis_db, check_online=False)
+        names = list(names)
+        if not names:
+            return {}
+
+        values = self.redis_db.mget(['board:' + name for name in names] + ['boardinfo:' + name for name in names])
+        snapshot = {}
+        for name, state, platform in zip(names, values[:len(names)], values[len(names):]):
+            if state is None:
+                continue
+            if isinstance(platform, bytes):
+                platform = platform.decode()
+                BOARDINFO_CACHE.set(name, platform)
+            snapshot[name] = (state.decode(), platform)
+        register_boards(self.redis_db, list(snapshot.keys()))
+        return snapshot
+
     def all(self):
         boards = []
-        for board_key in self.redis_db.keys('board:*'):
-            name = board_key[6:]
-            boards.append(MicropythonBoard(name, redis_db=self.redis_db))
+        for name, (state, platform) in sorted(self.snapshot().items()):
+            boards.append(self._board(name))
         return boards
 
     def get(self, name):
         if self.redis_db.exists('board:'+name):
-            return MicropythonBoard(name)
+            register_boards(self.redis_db, [name])
+            return self._board(name)
         raise NoSuchBoard('No such board %r registered with this cloudmanager' % name)
 
     def filter(self, filter_platforms=None, filter_states=None, range=None):
@@ -328,109 +1167,463 @@ class MicropythonBoards(object):
             filter_states = []
         if not range:
             range = []
-        range = hostlists.expand(range)
-        for board in self.all():
-            if filter_platforms and board.platform not in filter_platforms:
-                continue
-            if filter_states and board.state not in filter_states:
+        import hostlists
+
+        range = set(hostlists.expand(range))
+        if range:
+            # Check the named boards directly, they may not have been added
+            # to the registry yet
+            names = range
+        else:
+            names = registered_board_names(self.redis_db, check_online=False)
+        for name, (state, platform) in sorted(self.snapshot(names).items()):
+            if filter_platforms and platform not in filter_platforms:
                 continue
-            if range and board.name not in range:
+            if filter_states and state not in filter_states:
                 continue
-            boards.append(board)
+            boards.append(self._board(name))
         return boards
 
-    def _execute_board(self, args):
-        board, command = args
-        return board.execute(command)
-
     def execute(self, command, **kwargs):
         filter_platforms = kwargs.get('platforms', None)
         filter_states = kwargs.get('states', None)
         range = kwargs.get('range', None)
+        concurrency = kwargs.get('concurrency', DEFAULT_CONCURRENCY)
+        raw_repl = kwargs.get('raw_repl', False)
         boards = self.filter(filter_platforms=filter_platforms, filter_states=filter_states, range=range)
-        # It would be better to yield results from a multiprocessing pool here
-        for board in boards:
-            yield board.execute(command)
+        operation = lambda board: board.execute(command, raw_repl=raw_repl)
+        for board, result, error in fan_out(boards, operation, concurrency=concurrency):
+            if error:
+                raise error
+            yield result
 
     def macro(self, macro, **kwargs):
         filter_platforms = kwargs.get('platforms', None)
         filter_states = kwargs.get('states', None)
         range = kwargs.get('range', None)
         args = kwargs.get('args', '')
+        concurrency = kwargs.get('concurrency', DEFAULT_CONCURRENCY)
+        raw_repl = kwargs.get('raw_repl', False)
         boards = self.filter(filter_platforms=filter_platforms, filter_states=filter_states, range=range)
-        # It would be better to yield results from a multiprocessing pool here
-        for board in boards:
-            try:
-                yield board.macro(macro, args)
-            except BoardNotResponding:
+        operation = lambda board: board.macro(macro, args, raw_repl=raw_repl)
+        for board, result, error in fan_out(boards, operation, concurrency=concurrency):
+            if isinstance(error, BoardNotResponding):
                 print('Board %r is not responding' % board.name)
+                continue
+            if error:
+                raise error
+            yield result
+
+    def upload(self, filename, dest, data=None, **kwargs):
+        """
+        Upload a file to the boards
+
+        The file is read, hashed and stored in redis once.  For each group
+        of up to concurrency boards the manifests are checked, the copy
+        transactions are created and sent with a pipeline each and then all
+        the completions are waited on together.
+
+        Parameters
+        ----------
+        filename : str
+            The file to upload
+
+        dest : str
+            The destination filename on the boards
+
+        data : bytes, optional
+            The file contents, if given they are uploaded instead of reading
+            the file
+
+        Returns
+        -------
+        dict
+            Dictionary mapping each board name to an UploadResult
+        """
+        return self.upload_files([(filename, dest, data)], **kwargs)[dest]
+
+    def upload_files(self, files, **kwargs):
+        """
+        Upload a set of files to the boards in one batch
+
+        The boards are filtered once.  For each group of up to concurrency
+        boards every copy is queued on every board with a single pipeline,
+        and all of the completions are then waited on together, so the
+        files don't each wait for the slowest board in turn.
+
+        Parameters
+        ----------
+        files : list
+            Tuples of the filename, the destination filename on the boards
+            and the file contents, the file is read if the contents are None
+
+        Returns
+        -------
+        dict
+            Dictionary mapping each destination filename to a dictionary
+            mapping each board name to an UploadResult
+        """
+        filter_platforms = kwargs.get('platforms', None)
+        filter_states = kwargs.get('states', None)
+        board_range = kwargs.get('range', None)
+        concurrency = kwargs.get('concurrency', None)
+        report = dict((dest, {}) for filename, dest, data in files)
+        if not files:
+            return report
+        boards = self.filter(filter_platforms=filter_platforms, filter_states=filter_states, range=board_range)
+        if not boards:
+            return report
+
+        loaded = []
+        for filename, dest, data in files:
+            if data is None:
+                with open(filename, 'rb') as file_handle:
+                    data = file_handle.read()
+            loaded.append((filename, dest, data))
+        sources = {}
+        if not concurrency or concurrency < 1:
+            concurrency = len(boards)
+        for offset in range(0, len(boards), concurrency):
+            group_report = self._upload_group(boards[offset:offset + concurrency], loaded, sources, kwargs)
+            for dest, results in group_report.items():
+                report[dest].update(results)
+        return report
+
+    def _upload_group(self, boards, files, sources, kwargs):
+        """
+        Upload files to a group of boards at once
+
+        Parameters
+        ----------
+        files : list
+            Tuples of the filename, the destination filename and the file
+            contents
+
+        sources : dict
+            The transaction source key and fields for each file hash and
+            encoding that has been stored, shared between the groups so the
+            data is only stored once
+
+        Returns
+        -------
+        dict
+            Dictionary mapping each destination filename to a dictionary
+            mapping each board name to an UploadResult
+        """
+        chunk_size = kwargs.get('chunk_size', None)
+        force = kwargs.get('force', False)
+        compress = kwargs.get('compress', False)
+        ttl = 3600
+        file_hashes = [hashlib.md5(data).hexdigest() for filename, dest, data in files]
+        report = dict((dest, {}) for filename, dest, data in files)
+
+        # The indexes of the files each board needs, in the order they are
+        # copied
+        needed = dict((board.name, list(range(len(files)))) for board in boards)
+        if not force:
+            pipeline = self.redis_db.pipeline(transaction=False)
+            for board in boards:
+                for filename, dest, data in files:
+                    pipeline.hget(board.manifest_key, dest)
+            manifest_hashes = iter(pipeline.execute())
+            for board in boards:
+                for index, (filename, dest, data) in enumerate(files):
+                    if next(manifest_hashes) == file_hashes[index].encode():
+                        print('Skipping unchanged file %s:%s' % (board.name, dest))
+                        report[dest][board.name] = UploadResult(board, True, skipped=True)
+                        needed[board.name].remove(index)
+            boards = [board for board in boards if needed[board.name]]
+            if not boards:
+                return report
+
+        encodings = {board.name: None for board in boards}
+        if compress:
+            pipeline = self.redis_db.pipeline(transaction=False)
+            for board in boards:
+                pipeline.sismember(board.capabilities_key, 'zlib')
+            for board, supported in zip(boards, pipeline.execute()):
+                if supported:
+                    encodings[board.name] = 'zlib'
+
+        for board in boards:
+            for index in needed[board.name]:
+                filename, dest, data = files[index]
+                source = (file_hashes[index], encodings[board.name])
+                if source in sources:
+                    continue
+                if chunk_size:
+                    chunk_file_hash, chunk_hashes = board.upload_chunks_to_redis(
+                        filename, chunk_size=chunk_size, ttl=ttl, encoding=source[1], data=data
+                    )
+                    sources[source] = (None, chunked_transaction_fields(
+                        chunk_file_hash, chunk_hashes, chunk_size, encoding=source[1]
+                    ))
+                else:
+                    file_key, stored_encoding = board.store_data(data, encoding=source[1])
+                    fields = {}
+                    if stored_encoding:
+                        fields = {'encoding': stored_encoding, 'wbits': COMPRESSION_WBITS}
+                    sources[source] = (file_key, fields)
+
+        copies = [(board, index) for board in boards for index in needed[board.name]]
+        transactions = {}
+        if chunk_size:
+            # Resume the pending chunked transfers of the same files
+            pipeline = self.redis_db.pipeline(transaction=False)
+            for board, index in copies:
+                pipeline.get('transfer:' + board.name + ':' + files[index][1])
+            pending = dict(
+                ((board.name, index), transaction.decode())
+                for (board, index), transaction in zip(copies, pipeline.execute()) if transaction
+            )
+            keys = list(pending.keys())
+            pipeline = self.redis_db.pipeline(transaction=False)
+            for key in keys:
+                pipeline.hmget(pending[key], 'md5', 'encoding')
+            for (name, index), (pending_hash, pending_encoding) in zip(keys, pipeline.execute()):
+                if pending_hash == file_hashes[index].encode() and \
+                        pending_encoding == (encodings[name] or '').encode():
+                    transactions[(name, index)] = pending[(name, index)]
+
+        created = [(board, index) for board, index in copies if (board.name, index) not in transactions]
+        pipeline = self.redis_db.pipeline(transaction=False)
+        for board, index in created:
+            file_key, fields = sources[(file_hashes[index], encodings[board.name])]
+            board.create_file_transaction(
+                file_key=file_key, dest=files[index][1], ttl=ttl, fields=fields, client=pipeline
+            )
+        for (board, index), transaction in zip(created, pipeline.execute()):
+            transactions[(board.name, index)] = transaction
+
+        pipeline = self.redis_db.pipeline(transaction=True)
+        for board in boards:
+            pipeline.delete(board.complete_key)
+            for index in needed[board.name]:
+                transaction = transactions[(board.name, index)]
+                if chunk_size:
+                    pipeline.set('transfer:' + board.name + ':' + files[index][1], transaction, ex=ttl)
+                pipeline.rpush(board.base_key + '.copy', transaction)
+        pipeline.execute()
+        start = time.time()
+        for board, index in copies:
+            print('Copying file to %s:%s' % (board.name, files[index][1]))
+
+        def wait_for_copies(board):
+            # The board copies the files in the order they were queued and
+            # pushes a completion for each of them
+            results = {}
+            for index in needed[board.name]:
+                dest = files[index][1]
+                try:
+                    rc = board.wait_for_copy(transactions[(board.name, index)], dest, chunked=bool(chunk_size))
+                except Exception as error:
+                    results[index] = UploadResult(board, False, error=error)
+                    break
+                results[index] = UploadResult(board, copy_succeeded(rc), latency=time.time() - start)
+                if rc is None:
+                    # The board stopped copying, don't wait for the rest
+                    break
+            for index in needed[board.name]:
+                if index not in results:
+                    results[index] = UploadResult(board, False)
+            return results
+
+        # The boards are all waited on through the dispatcher, which uses a
+        # single BLPOP for all of them
+        for board, results, error in fan_out(boards, wait_for_copies, concurrency=len(boards)):
+            for index, result in results.items():
+                report[files[index][1]][board.name] = result
+
+        pipeline = self.redis_db.pipeline(transaction=False)
+        for board in boards:
+            for index in needed[board.name]:
+                dest = files[index][1]
+                if report[dest][board.name].success:
+                    pipeline.hset(board.manifest_key, dest, file_hashes[index])
+        pipeline.execute()
+        return report
+
+    def upload_compiled(self, filename, dest, data=None, **kwargs):
+        """
+        Compile a python source file to .mpy for the platform of each board
+        and upload the compiled file in place of the source.  The source is
+        uploaded to boards whose platform it can't be compiled for or whose
+        firmware can't load it.
+
+        Parameters
+        ----------
+        filename : str
+            The python source file
+
+        dest : str
+            The destination filename of the source on the boards
+
+        data : bytes, optional
+            The python source, if given it is compiled instead of reading
+            the file
+
+        Returns
+        -------
+        dict
+            Dictionary mapping each board name to the UploadResult of the
+            file uploaded to it
+        """
+        report = {}
+        for results in self.upload_compiled_files([(filename, dest, data)], **kwargs).values():
+            report.update(results)
+        return report
+
+    def upload_compiled_files(self, files, **kwargs):
+        """
+        Compile python source files to .mpy for the platform of each board
+        and upload the compiled files in place of the sources in one batch
+        per platform.  The sources are uploaded to boards whose platform
+        they can't be compiled for and to boards whose firmware can't load
+        the compiled files or did not report the mpy version it loads.
+
+        Parameters
+        ----------
+        files : list
+            Tuples of the source filename, the destination filename of the
+            source on the boards and the source, the file is read if the
+            source is None
 
-    def upload(self, filename, dest, **kwargs):
+        Returns
+        -------
+        dict
+            Dictionary mapping the destination filename of each uploaded file
+            to a dictionary mapping each board name to an UploadResult
+        """
         filter_platforms = kwargs.get('platforms', None)
         filter_states = kwargs.get('states', None)
         range = kwargs.get('range', None)
         boards = self.filter(filter_platforms=filter_platforms, filter_states=filter_states, range=range)
-        # It would be better to yield results from a multiprocessing pool here
-        for board in boards:
-            board.upload(filename, dest)
+        concurrency = kwargs.get('concurrency', None) or DEFAULT_CONCURRENCY
+        report = {}
+        for platform in set(board.platform for board in boards):
+            platform_boards = [board for board in boards if board.platform == platform]
+            compiled_files = {}
+            for filename, dest, data in files:
+                compiled = compile_mpy(filename, platform, data=data)
+                if compiled:
+                    compiled_files[dest] = (compiled, dest[:-3] + '.mpy', mpy_file_version(compiled))
+
+            # Group the boards by the compiled files their firmware can load
+            groups = {}
+            versions = {}
+            if compiled_files:
+                for board, version, error in fan_out(platform_boards, lambda board: board.mpy_version(), concurrency):
+                    if error:
+                        LOG.warning('Unable to get the mpy version of board %r: %s', board.name, error)
+                    versions[board.name] = None if error else version
+            for board in platform_boards:
+                loadable = frozenset(
+                    dest for dest, (compiled, compiled_dest, version) in compiled_files.items()
+                    if version is not None and version == versions.get(board.name)
+                )
+                groups.setdefault(loadable, []).append(board)
+
+            for loadable, group in groups.items():
+                group_files = []
+                for filename, dest, data in files:
+                    if dest in loadable:
+                        group_files.append(compiled_files[dest][:2] + (None,))
+                    else:
+                        group_files.append((filename, dest, data))
+                group_kwargs = dict(kwargs, platforms=[platform], range=[board.name for board in group])
+                group_report = self.upload_files(group_files, **group_kwargs)
+                for dest, results in group_report.items():
+                    report.setdefault(dest, {}).update(results)
+
+                # Micropython imports a .py file before a .mpy file with the
+                # same name, so remove source previously uploaded to the
+                # boards that received the compiled file
+                for dest in loadable:
+                    compiled, compiled_dest, version = compiled_files[dest]
+                    uploaded = [
+                        board for board in group
+                        if group_report[compiled_dest].get(board.name) and
+                        group_report[compiled_dest][board.name].success
+                    ]
+                    self._remove_compiled_source(uploaded, dest, version, concurrency)
+        return report
+
+    def _remove_compiled_source(self, boards, dest, version, concurrency=None):
+        """
+        Remove the source of a compiled file from the boards that have it
+        in their manifest and can load the compiled file
+        """
+        if version is None:
+            return
+
+        def remove_source(board):
+            if not board.redis_db.hexists(board.manifest_key, dest):
+                return
+            result = board.execute(REMOVE_COMPILED_SOURCE.format(version=version, dest=dest))
+            if result.return_code:
+                LOG.warning('Keeping %r on board %r, it could not be removed or the board does not support mpy '
+                            'version %d', dest, board.name, version)
+                return
+            board.forget(dest)
+
+        for board, result, error in fan_out(boards, remove_source, concurrency=concurrency or DEFAULT_CONCURRENCY):
+            if error:
+                LOG.warning('Unable to remove %r from board %r: %s', dest, board.name, error)
 
     def install(self, package_name, **kwargs):
-        if package_name in self.installed_packages:
-            return
-        cwd = os.getcwd()
-        tempdir = tempfile.mkdtemp()
-        os.chdir(tempdir)
-        package_version = None
-        temp = package_name.split('=')
-
-        package_name = temp[0]
-        if len(temp) == 2:
-            package_version = temp[-1]
-
-        # command = 'pip install --prefix={tempdir} {package}'.format(
-        #     executable=sys.executable, tempdir=tempdir, package=package_name
-        # )
-        # print(command)
-        # output = subprocess.check_output(command.split())
-        # os.system(command)
-        package_info = self.get_pypi_info(package_name)
-        if not package_version:
-            package_version = package_info['info']['version']
-        url = package_info['releases'][package_version][0]['url']
-        response = requests.get(url)
-        with open(os.path.basename(url), 'wb') as file_handle:
-            file_handle.write(response.content)
-
-        tar = tarfile.open(os.path.basename(url))
-        tar.extractall()
-        tar.close()
-
-        for pkg_dir in os.listdir('.'):
-            if os.path.isdir(pkg_dir):
-                break
-        os.chdir(pkg_dir)
-        self.installed_packages.append(package_name)
-        print('Installing package %r' % package_name)
-        for root, dirs, files in os.walk('.'):
-            for name in files:
-                filename = os.path.join(root, name)
-                if name in ['setup.py', 'setup.cfg', 'PKG-INFO']:
-                    continue
-                if name in ['requires.txt']:
-                    for line in open(filename).readlines():
-                        self.install(line.strip(), **kwargs)
-                # if filename.endswith('.py'):
-                if '.egg-info/' not in filename:
-                    if filename.startswith('./'):
-                        filename = filename[2:]
-                    dest = os.path.join('lib', filename)
-                    # print(filename, dest)
-                    self.upload(filename=filename, dest=dest, **kwargs)
-        os.chdir(cwd)
-        shutil.rmtree(tempdir)
+        """
+        Install a package and its dependencies on the boards
 
+        The full dependency graph is resolved first, the source
+        distributions are fetched concurrently and then the merged set of
+        files from all the packages is uploaded to the boards in one batch.
+
+        Parameters
+        ----------
+        package_name : str
+            The package requirement, for example micropython-logging or
+            micropython-logging==0.5
+
+        dry_run : bool, optional
+            Print the deployment plan without uploading anything,
+            default=False
+
+        Returns
+        -------
+        list
+            The deployment plan, tuples of the package, the tar member name
+            and the destination filename on the boards
+        """
+        import tarfile
+        from .installer import deployment_plan, fetch_packages, resolve_dependencies
+
+        packages = resolve_dependencies(self.package_cache, [package_name], exclude=self.installed_packages)
+        fetch_packages(self.package_cache, packages)
+        plan = deployment_plan(packages)
+        if kwargs.get('dry_run', False):
+            for package, member_name, dest in plan:
+                print('%s: %s -> %s' % (package, member_name, dest))
+            return plan
+
+        deploy = {}
+        for package, member_name, dest in plan:
+            deploy.setdefault(package, {})[member_name] = dest
+        files = []
+        for package in packages:
+            print('Installing package %r' % package.name)
+            # Stream the members from the source distribution and upload
+            # them from memory
+            with tarfile.open(package.sdist, 'r|*') as tar:
+                for member in tar:
+                    dest = deploy.get(package, {}).get(member.name)
+                    if dest:
+                        files.append((member.name, dest, tar.extractfile(member).read()))
+        if kwargs.get('precompile', False):
+            self.upload_compiled_files([item for item in files if can_compile(item[1])], **kwargs)
+            files = [item for item in files if not can_compile(item[1])]
+        self.upload_files(files, **kwargs)
+        self.installed_packages += [package.name for package in packages]
+        return plan
 
     def get_pypi_info(self, package_name):
-        url = 'https://pypi.python.org/pypi/{package}/json'.format(package=package_name)
-        response = requests.get(url)
-        return response.json()
+        return self.package_cache.metadata(package_name)
@@ -0,0 +1,117 @@
+"""
+Per process cache of the board information stored in the boardinfo: keys
+"""
+import threading
+import time
+from .utility import enable_keyspace_events
+
+
+BOARDINFO_CACHE_TTL = 300
+
+
+class BoardInfoCache(object):
+    """
+    Cache of the boardinfo values for boards
+
+    Values expire after ttl seconds and can be invalidated explicitly.  When
+    watch() is called the cache also subscribes to the keyspace notifications
+    for the boardinfo keys and drops values as soon as they change.
+    """
+    def __init__(self, ttl=BOARDINFO_CACHE_TTL):
+        self.ttl = ttl
+        self._values = {}
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def get(self, redis_db, name):
+        """
+        Get the boardinfo value for a board
+
+        Parameters
+        ----------
+        redis_db : redis.Redis
+            The redis connection to fetch the value with if it is not cached
+
+        name : str
+            The name of the board
+
+        Returns
+        -------
+        str or None
+            The boardinfo value, None if the board has no boardinfo
+        """
+        with self._lock:
+            value, expires = self._values.get(name, (None, 0))
+        if expires > time.time():
+            return value
+        value = redis_db.get('boardinfo:' + name)
+        if isinstance(value, bytes):
+            value = value.decode()
+        if value is not None:
+            self.set(name, value)
+        return value
+
+    def set(self, name, value):
+        """
+        Store the boardinfo value for a board
+
+        Parameters
+        ----------
+        name : str
+            The name of the board
+
+        value : str
+            The boardinfo value
+        """
+        with self._lock:
+            self._values[name] = (value, time.time() + self.ttl)
+
+    def invalidate(self, name=None):
+        """
+        Drop cached values
+
+        Parameters
+        ----------
+        name : str, optional
+            The board to drop the value for, default drops all values
+        """
+        with self._lock:
+            if name is None:
+                self._values = {}
+            else:
+                self._values.pop(name, None)
+
+    def _handle_notification(self, message):
+        channel = message['channel']
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        self.invalidate(channel.split(':boardinfo:', 1)[-1])
+
+    def watch(self, redis_db):
+        """
+        Invalidate values as soon as the boardinfo keys change by subscribing
+        to the keyspace notifications for them.
+
+        Parameters
+        ----------
+        redis_db : redis.Redis
+            The redis connection
+        """
+        if self._watcher:
+            return
+        enable_keyspace_events(redis_db, 'K$g')
+        pubsub = redis_db.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(**{'__keyspace@*__:boardinfo:*': self._handle_notification})
+        self._watcher = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def unwatch(self):
+        """
+        Stop invalidating values from the keyspace notifications
+        """
+        if self._watcher:
+            self._watcher.stop()
+            self._watcher.join()
+            self._watcher = None
+
+
+BOARDINFO_CACHE = BoardInfoCache()
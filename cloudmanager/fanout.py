@@ -0,0 +1,209 @@
+"""
+Run an operation against many boards concurrently
+"""
+import queue
+import threading
+import time
+import uuid
+from .exceptions import BoardNotResponding
+
+
+DEFAULT_CONCURRENCY = 32
+
+
+def _run_operation(args):
+    operation, board = args
+    try:
+        return board, operation(board), None
+    except Exception as error:
+        return board, None, error
+
+
+def fan_out(boards, operation, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Run an operation on a group of boards and yield the results as each
+    board finishes.
+
+    Up to concurrency boards are operated on at the same time, so the
+    command is sent to every board in the window before any of the
+    completions are waited on.  The total run time tracks the slowest board
+    instead of the sum of all of them.
+
+    Parameters
+    ----------
+    boards : list
+        The MicropythonBoard objects to operate on
+
+    operation : callable
+        Function that is called with a board and returns the result for it
+
+    concurrency : int, optional
+        Maximum number of boards to have in flight at once, default=32
+
+    Yields
+    ------
+    tuple
+        A (board, result, error) tuple in completion order.  If the operation
+        raised an exception result is None and error is the exception.
+    """
+    boards = list(boards)
+    if not boards:
+        return
+    if not concurrency or concurrency < 1:
+        concurrency = len(boards)
+    concurrency = min(concurrency, len(boards))
+    from multiprocessing.pool import ThreadPool
+
+    with ThreadPool(processes=concurrency) as pool:
+        for item in pool.imap_unordered(_run_operation, [(operation, board) for board in boards]):
+            yield item
+
+
+class CompletionDispatcher(object):
+    """
+    Wait for completions from many boards using a single redis connection
+
+    A single background thread issues one BLPOP across the complete key of
+    every board that is being waited on and routes each completion to the
+    thread waiting for that board.  The state of the boards that are being
+    waited on is checked with a single MGET so boards that stop responding
+    are detected without a request per board.
+    """
+    def __init__(self, redis_db, poll_interval=1):
+        self.redis_db = redis_db
+        self.poll_interval = poll_interval
+        self.wakeup_key = 'dispatcher:' + uuid.uuid4().hex + '.wakeup'
+        self._waiters = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def wait(self, board, timeout=None, check_state=True):
+        """
+        Wait for a board to push a value to its complete key
+
+        Parameters
+        ----------
+        board : MicropythonBoard
+            The board to wait on
+
+        timeout : int, optional
+            Number of seconds to wait, default None waits until the board
+            completes or stops responding
+
+        check_state : bool, optional
+            Raise BoardNotResponding if the board goes idle or away while
+            waiting, default=True
+
+        Returns
+        -------
+        bytes or None
+            The value the board pushed to the complete key or None if the
+            timeout expired
+
+        Raises
+        ------
+        BoardNotResponding
+            The board stopped responding before completing
+        """
+        waiter = queue.Queue(maxsize=1)
+        with self._lock:
+            self._waiters[board.complete_key] = (board, waiter, time.time(), check_state)
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name='CompletionDispatcher')
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup()
+
+        try:
+            result = waiter.get(timeout=timeout)
+        except queue.Empty:
+            with self._lock:
+                if self._waiters.get(board.complete_key, (None, None))[1] is waiter:
+                    del self._waiters[board.complete_key]
+                    return
+            # The result was delivered while the timeout was being handled
+            result = waiter.get()
+
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _wakeup(self):
+        """
+        Interrupt the running BLPOP so it picks up newly registered keys
+        """
+        pipeline = self.redis_db.pipeline()
+        pipeline.rpush(self.wakeup_key, 1)
+        pipeline.expire(self.wakeup_key, 60)
+        pipeline.execute()
+
+    def _deliver(self, complete_key, value):
+        with self._lock:
+            entry = self._waiters.pop(complete_key, None)
+        if entry:
+            entry[1].put(value)
+        elif not isinstance(value, Exception):
+            # The waiter timed out after the value was popped, put it back
+            # for the next wait on the board
+            self.redis_db.lpush(complete_key, value)
+
+    def _check_state(self):
+        """
+        Fail the waiters for boards that have gone idle or away without
+        completing.
+        """
+        now = time.time()
+        with self._lock:
+            suspects = [
+                entry[0] for entry in self._waiters.values()
+                if entry[3] and now - entry[2] >= self.poll_interval
+            ]
+        if not suspects:
+            return
+        states = self.redis_db.mget([board.status_key for board in suspects])
+        for board, state in zip(suspects, states):
+            if state and state not in [b'idle']:
+                continue
+            # The board may have completed just before going idle
+            value = self.redis_db.lpop(board.complete_key)
+            if value is not None:
+                self._deliver(board.complete_key, value)
+                continue
+            self._deliver(
+                board.complete_key, BoardNotResponding('Board {0} is not responding\n'.format(board.name))
+            )
+
+    def _fail_waiters(self, error):
+        """
+        Stop the dispatcher thread and deliver an error to every waiter, the
+        next wait() starts a new thread.
+        """
+        with self._lock:
+            entries = list(self._waiters.values())
+            self._waiters = {}
+            self._thread = None
+        for entry in entries:
+            entry[1].put(error)
+
+    def _run(self):
+        last_check = time.time()
+        try:
+            while True:
+                with self._lock:
+                    if not self._waiters:
+                        self._thread = None
+                        break
+                    keys = list(self._waiters.keys())
+                item = self.redis_db.blpop(keys + [self.wakeup_key], timeout=self.poll_interval)
+                if item:
+                    key, value = item
+                    if isinstance(key, bytes):
+                        key = key.decode()
+                    if key != self.wakeup_key:
+                        self._deliver(key, value)
+                if time.time() - last_check >= self.poll_interval:
+                    self._check_state()
+                    last_check = time.time()
+            self.redis_db.delete(self.wakeup_key)
+        except Exception as error:
+            self._fail_waiters(error)
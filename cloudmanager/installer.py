@@ -0,0 +1,253 @@
+"""
+Dependency resolution and deployment planning for board-install
+
+Installing a package is split into three stages, the full dependency graph
+is resolved, the source distributions are fetched concurrently and then the
+merged set of files from all the packages is deployed to the boards once.
+"""
+import logging
+import os
+import re
+import tarfile
+from multiprocessing.pool import ThreadPool
+
+
+LOG = logging.getLogger(__name__)
+
+# Number of packages resolved and downloaded at the same time
+DEFAULT_FETCH_CONCURRENCY = 8
+
+# Packaging files that are not installed on the boards
+EXCLUDED_FILES = ['setup.py', 'setup.cfg', 'PKG-INFO']
+
+
+def parse_requirement(requirement):
+    """
+    Split a requirement string into the package name and version
+
+    Parameters
+    ----------
+    requirement : str
+        The requirement, for example micropython-os or micropython-os==0.4
+
+    Returns
+    -------
+    tuple
+        The package name and the pinned version, the version is None if the
+        requirement does not pin one.
+    """
+    match = re.match(r'\s*([^\s<>=!~;\[]+)\s*(==?\s*([^\s,;]+))?', requirement)
+    if not match:
+        raise ValueError('Invalid requirement %r' % requirement)
+    return match.group(1), match.group(3)
+
+
+def read_requirements(sdist):
+    """
+    Read the requirements of a package from the requires.txt file in its
+    source distribution.  Requirements in extras sections are ignored.
+
+    Parameters
+    ----------
+    sdist : str
+        The source distribution filename
+
+    Returns
+    -------
+    list
+        The requirement strings
+    """
+    requirements = []
+    with tarfile.open(sdist, 'r|*') as tar:
+        for member in tar:
+            if member.isfile() and member.name.endswith('.egg-info/requires.txt'):
+                for line in tar.extractfile(member).read().decode().splitlines():
+                    line = line.strip()
+                    if line.startswith('['):
+                        # Only install the requirements that are not extras
+                        break
+                    if line:
+                        requirements.append(line)
+                break
+    return requirements
+
+
+def package_files(sdist):
+    """
+    Get the files in a source distribution that are installed on the boards
+
+    Parameters
+    ----------
+    sdist : str
+        The source distribution filename
+
+    Returns
+    -------
+    list
+        Tuples of the tar member name and the destination filename relative
+        to the package directory
+    """
+    files = []
+    with tarfile.open(sdist, 'r|*') as tar:
+        for member in tar:
+            if not member.isfile() or '.egg-info/' in member.name:
+                continue
+            if os.path.basename(member.name) in EXCLUDED_FILES:
+                continue
+            # Strip the <package>-<version>/ directory
+            parts = member.name.split('/', 1)
+            if len(parts) < 2:
+                continue
+            files.append((member.name, parts[1]))
+    return files
+
+
+class Package(object):
+    """
+    A resolved package in an install plan
+
+    Parameters
+    ----------
+    name : str
+        The package name
+
+    version : str
+        The package version
+
+    sdist : str, optional
+        The source distribution filename once it has been fetched
+
+    requirements : list, optional
+        The requirement strings of the package
+    """
+    def __init__(self, name, version, sdist=None, requirements=None):
+        self.name = name
+        self.version = version
+        self.sdist = sdist
+        self.requirements = requirements or []
+
+    def __repr__(self):
+        return '%s-%s' % (self.name, self.version)
+
+
+def _resolve_package(package_cache, requirement):
+    name, version = parse_requirement(requirement)
+    version = package_cache.resolve_version(name, version)
+    package = Package(name, version)
+    requirements = package_cache.requirements(name, version)
+    if requirements is None:
+        # The requirements are only available from the source distribution
+        package.version, package.sdist = package_cache.sdist(name, version, evict=False)
+        requirements = read_requirements(package.sdist)
+        package_cache.set_requirements(name, version, requirements)
+    package.requirements = requirements
+    return package
+
+
+def resolve_dependencies(package_cache, requirements, exclude=None, concurrency=DEFAULT_FETCH_CONCURRENCY):
+    """
+    Resolve the full dependency graph of a list of requirements.  Each level
+    of the graph is resolved concurrently.
+
+    Parameters
+    ----------
+    package_cache : cloudmanager.package_cache.PackageCache
+        The package cache to get the package metadata and requirements from
+
+    requirements : list
+        The requirement strings to install
+
+    exclude : list, optional
+        Names of packages that don't need to be installed
+
+    concurrency : int, optional
+        Maximum number of packages to resolve at the same time, default=8
+
+    Returns
+    -------
+    list
+        The Package objects, each package appears once in the order it was
+        found.
+    """
+    seen = set(exclude or [])
+    packages = []
+    pool = ThreadPool(concurrency)
+    try:
+        while requirements:
+            level = []
+            for requirement in requirements:
+                name = parse_requirement(requirement)[0]
+                if name not in seen:
+                    seen.add(name)
+                    level.append(requirement)
+            resolved = pool.map(lambda requirement: _resolve_package(package_cache, requirement), level)
+            packages += resolved
+            requirements = [requirement for package in resolved for requirement in package.requirements]
+    finally:
+        pool.close()
+        pool.join()
+    return packages
+
+
+def fetch_packages(package_cache, packages, concurrency=DEFAULT_FETCH_CONCURRENCY):
+    """
+    Fetch the source distributions of packages that have not been fetched
+    yet concurrently.  The package cache is evicted once all of them have
+    been fetched, keeping the source distributions of the packages.
+
+    Parameters
+    ----------
+    package_cache : cloudmanager.package_cache.PackageCache
+        The package cache to get the source distributions from
+
+    packages : list
+        The Package objects to fetch
+
+    concurrency : int, optional
+        Maximum number of downloads at the same time, default=8
+    """
+    def fetch(package):
+        package.version, package.sdist = package_cache.sdist(package.name, package.version, evict=False)
+
+    pending = [package for package in packages if not package.sdist]
+    if pending:
+        pool = ThreadPool(concurrency)
+        try:
+            pool.map(fetch, pending)
+        finally:
+            pool.close()
+            pool.join()
+    package_cache.evict(keep=[package.sdist for package in packages])
+
+
+def deployment_plan(packages, prefix='lib'):
+    """
+    Merge the files of packages into a single deployment plan
+
+    Parameters
+    ----------
+    packages : list
+        The fetched Package objects
+
+    prefix : str, optional
+        The directory on the boards the packages are installed in,
+        default=lib
+
+    Returns
+    -------
+    list
+        Tuples of the Package, the tar member name and the destination
+        filename on the boards.  When several packages contain the same
+        file the one from the first package is used.
+    """
+    plan = []
+    destinations = set()
+    for package in packages:
+        for member_name, filename in package_files(package.sdist):
+            dest = os.path.join(prefix, filename)
+            if dest in destinations:
+                LOG.debug('Skipping %r from %r, it is provided by another package', dest, package)
+                continue
+            destinations.add(dest)
+            plan.append((package, member_name, dest))
+    return plan
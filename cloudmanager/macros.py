@@ -0,0 +1,44 @@
+"""
+Python code snippets run on the boards by the board macro commands
+"""
+
+
+MACROS = {
+    'echo': """print({args})
+""",
+    'reset': """import machine
+print('resetting{args}')
+machine.reset()
+
+""",
+    'ls': """import os
+for line in os.listdir({args}):
+    print(line.strip())
+
+""",
+    'mkdir': """import os
+os.mkdir({args})
+
+""",
+    'rmdir': """import os
+os.rmdir({args})
+
+""",
+    'mem_free': """import gc
+gc.collect()
+print(gc.mem_free())
+
+""",
+    'set': """from bootconfig.config import set
+key, value={args}.split('=')
+set(key, value)
+
+""",
+    'settings': """from bootconfig.config import list_settings
+list_settings()
+""",
+    'uname': """import os
+print(os.uname())
+
+"""
+}
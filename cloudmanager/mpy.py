@@ -0,0 +1,165 @@
+"""
+Compile python source files to micropython .mpy files on the server
+
+The mpy-cross compiler is found from the mpy_cross python package or the
+mpy-cross executable on the path.  Compiled files are cached by the content
+hash of the source, the target architecture and the mpy version.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+from .utility import CACHE_DIRECTORY
+
+
+LOG = logging.getLogger(__name__)
+
+MPY_CACHE_DIRECTORY = os.path.join(CACHE_DIRECTORY, 'mpy')
+
+# The mpy-cross -march value for the native code of each board platform
+PLATFORM_ARCHITECTURES = {
+    'esp8266': 'xtensa',
+    'esp32': 'xtensawin',
+    'pyboard': 'armv7m',
+    'wipy': 'armv7m',
+    'rp2': 'armv6m',
+}
+
+# Files that must stay as source on the board
+SOURCE_ONLY_FILES = ['boot.py', 'main.py']
+
+_mpy_cross = None
+_mpy_version = None
+
+
+def mpy_cross_executable():
+    """
+    Find the mpy-cross compiler
+
+    Returns
+    -------
+    str or None
+        The path to the mpy-cross executable, None if it is not available
+    """
+    global _mpy_cross
+    if _mpy_cross is None:
+        try:
+            import mpy_cross
+            _mpy_cross = getattr(mpy_cross, 'mpy_cross', None) or ''
+        except ImportError:
+            _mpy_cross = ''
+        if not _mpy_cross:
+            _mpy_cross = shutil.which('mpy-cross') or ''
+    return _mpy_cross or None
+
+
+def mpy_version():
+    """
+    Get the version of the mpy-cross compiler
+
+    Returns
+    -------
+    str
+        The version line reported by mpy-cross
+    """
+    global _mpy_version
+    if _mpy_version is None:
+        output = subprocess.check_output([mpy_cross_executable(), '--version'])
+        _mpy_version = output.decode().strip()
+    return _mpy_version
+
+
+def can_compile(filename):
+    """
+    Check if a file should be compiled before uploading it to a board
+
+    Parameters
+    ----------
+    filename : str
+        The name of the file
+
+    Returns
+    -------
+    bool
+        True if the file is python source that can be compiled
+    """
+    return filename.endswith('.py') and os.path.basename(filename) not in SOURCE_ONLY_FILES
+
+
+def mpy_file_version(filename):
+    """
+    Get the mpy version of a compiled file from its header
+
+    Parameters
+    ----------
+    filename : str
+        The .mpy file
+
+    Returns
+    -------
+    int or None
+        The mpy version, None if the file is not a .mpy file
+    """
+    with open(filename, 'rb') as file_handle:
+        file_header = file_handle.read(2)
+    if len(file_header) < 2 or file_header[:1] != b'M':
+        return
+    return file_header[1]
+
+
+def compile_mpy(filename, platform=None, data=None):
+    """
+    Compile a python source file to a .mpy file for a board platform
+
+    Parameters
+    ----------
+    filename : str
+        The python source file
+
+    platform : str, optional
+        The board platform from boardinfo, used to select the native code
+        architecture
+
+    data : bytes, optional
+        The python source, if given it is compiled instead of reading the
+        file and filename is only used as the source name
+
+    Returns
+    -------
+    str or None
+        The path of the compiled file in the cache, None if the file could
+        not be compiled
+    """
+    executable = mpy_cross_executable()
+    if not executable:
+        LOG.warning('mpy-cross is not installed, uploading %r as source', filename)
+        return
+
+    arch = PLATFORM_ARCHITECTURES.get((platform or '').lower(), '')
+    if data is None:
+        with open(filename, 'rb') as file_handle:
+            data = file_handle.read()
+        source = filename
+    else:
+        # Compile the source from stdin
+        source = '-'
+    source_hash = hashlib.md5(data).hexdigest()
+    version_hash = hashlib.md5(mpy_version().encode()).hexdigest()[:12]
+    cache_directory = os.path.join(MPY_CACHE_DIRECTORY, version_hash, arch or 'bytecode')
+    compiled = os.path.join(cache_directory, source_hash + '.mpy')
+    if os.path.exists(compiled):
+        return compiled
+
+    os.makedirs(cache_directory, exist_ok=True)
+    command = [executable, '-o', compiled + '.tmp', '-s', os.path.basename(filename)]
+    if arch:
+        command.append('-march=' + arch)
+    command.append(source)
+    try:
+        subprocess.check_output(command, input=data, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as error:
+        LOG.warning('Unable to compile %r, uploading as source: %s', filename, error.output.decode().strip())
+        return
+    os.rename(compiled + '.tmp', compiled)
+    return compiled
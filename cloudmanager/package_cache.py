@@ -0,0 +1,283 @@
+"""
+Persistent on disk cache of python package metadata and source
+distributions used by board-install
+"""
+import json
+import logging
+import os
+import re
+import time
+import requests
+from .utility import CACHE_DIRECTORY
+
+
+LOG = logging.getLogger(__name__)
+
+PACKAGE_CACHE_DIRECTORY = os.path.join(CACHE_DIRECTORY, 'packages')
+PYPI_URL = 'https://pypi.org/pypi/{package}/json'
+
+# Maximum size of the cached source distributions in bytes
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+# Number of seconds before cached package metadata is refreshed
+METADATA_TTL = 3600
+
+
+def version_key(version):
+    """
+    Sort key for version strings, compares the numeric parts numerically
+    """
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in re.split(r'[.\-]', version)]
+
+
+class PackageCache(object):
+    """
+    Cache of package metadata, source distributions and package
+    requirements.
+
+    Parameters
+    ----------
+    directory : str, optional
+        The cache directory, default ~/.cache/cloudmanager/packages
+
+    max_size : int, optional
+        Maximum size of the cached source distributions in bytes, the least
+        recently used are removed when it is exceeded.
+
+    metadata_ttl : int, optional
+        Number of seconds before cached metadata is refreshed from pypi
+
+    offline_directory : str, optional
+        Directory pre-seeded with source distributions and <package>.json
+        metadata files that is checked before the cache and pypi
+
+    offline : bool, optional
+        Never access the network, default=False
+    """
+    def __init__(self, directory=PACKAGE_CACHE_DIRECTORY, max_size=DEFAULT_CACHE_SIZE, metadata_ttl=METADATA_TTL,
+                 offline_directory=None, offline=False):
+        self.directory = directory
+        self.max_size = max_size
+        self.metadata_ttl = metadata_ttl
+        self.offline_directory = offline_directory
+        self.offline = offline
+        self.metadata_directory = os.path.join(directory, 'metadata')
+        self.sdist_directory = os.path.join(directory, 'sdist')
+        self.requirements_directory = os.path.join(directory, 'requirements')
+        for cache_directory in [self.metadata_directory, self.sdist_directory, self.requirements_directory]:
+            os.makedirs(cache_directory, exist_ok=True)
+
+    def _write_json(self, filename, data):
+        with open(filename + '.tmp', 'w') as file_handle:
+            json.dump(data, file_handle)
+        os.replace(filename + '.tmp', filename)
+
+    def metadata(self, package_name):
+        """
+        Get the pypi json metadata for a package
+
+        Parameters
+        ----------
+        package_name : str
+            The name of the package
+
+        Returns
+        -------
+        dict or None
+            The package metadata, None if it is not available offline
+        """
+        if self.offline_directory:
+            offline_metadata = os.path.join(self.offline_directory, package_name + '.json')
+            if os.path.exists(offline_metadata):
+                with open(offline_metadata) as file_handle:
+                    return json.load(file_handle)
+
+        cached = os.path.join(self.metadata_directory, package_name + '.json')
+        fresh = os.path.exists(cached) and time.time() - os.path.getmtime(cached) < self.metadata_ttl
+        if not fresh and not self.offline:
+            try:
+                response = requests.get(PYPI_URL.format(package=package_name))
+                response.raise_for_status()
+                self._write_json(cached, response.json())
+            except (requests.RequestException, ValueError):
+                LOG.warning('Unable to fetch the metadata for %r, using the cached copy', package_name)
+        if os.path.exists(cached):
+            with open(cached) as file_handle:
+                return json.load(file_handle)
+
+    def _offline_sdists(self, package_name):
+        """
+        Get the source distributions for a package in the offline directory
+
+        Returns
+        -------
+        dict
+            Dictionary mapping each version to the sdist filename
+        """
+        sdists = {}
+        if not self.offline_directory or not os.path.isdir(self.offline_directory):
+            return sdists
+        prefix = package_name + '-'
+        for filename in os.listdir(self.offline_directory):
+            if filename.startswith(prefix) and filename.endswith('.tar.gz'):
+                sdists[filename[len(prefix):-len('.tar.gz')]] = os.path.join(self.offline_directory, filename)
+        return sdists
+
+    def resolve_version(self, package_name, version=None):
+        """
+        Get the version of a package to install
+
+        Parameters
+        ----------
+        package_name : str
+            The name of the package
+
+        version : str, optional
+            The requested version, default is the latest version
+
+        Returns
+        -------
+        str
+            The version
+        """
+        if version:
+            return version
+        metadata = self.metadata(package_name)
+        if metadata:
+            return metadata['info']['version']
+        versions = sorted(self._offline_sdists(package_name).keys(), key=version_key)
+        if not versions:
+            raise ValueError('No version of package %r is available' % package_name)
+        return versions[-1]
+
+    def sdist(self, package_name, version=None, evict=True):
+        """
+        Get the source distribution of a package, downloading it if it is
+        not cached.
+
+        Parameters
+        ----------
+        package_name : str
+            The name of the package
+
+        version : str, optional
+            The version of the package, default is the latest version
+
+        evict : bool, optional
+            Evict the least recently used source distributions after a
+            download, default=True.  Callers that fetch several packages
+            concurrently evict once when they are done instead.
+
+        Returns
+        -------
+        tuple
+            The version and the path of the source distribution
+        """
+        version = self.resolve_version(package_name, version)
+
+        offline_sdist = self._offline_sdists(package_name).get(version)
+        if offline_sdist:
+            return version, offline_sdist
+
+        cache_directory = os.path.join(self.sdist_directory, package_name, version)
+        if os.path.isdir(cache_directory):
+            for filename in os.listdir(cache_directory):
+                if not filename.endswith('.tmp'):
+                    cached = os.path.join(cache_directory, filename)
+                    # Mark the file as recently used so it is evicted last
+                    os.utime(cached)
+                    return version, cached
+
+        if self.offline:
+            raise ValueError('Package %s-%s is not available offline' % (package_name, version))
+
+        metadata = self.metadata(package_name)
+        if not metadata:
+            raise ValueError('Package %s-%s is not available, its metadata could not be fetched' % (
+                package_name, version
+            ))
+        releases = metadata['releases'].get(version)
+        if not releases:
+            raise ValueError('Package %s-%s is not available on PyPI' % (package_name, version))
+        release = [release for release in releases if release.get('packagetype') == 'sdist'] or releases
+        url = release[0]['url']
+        os.makedirs(cache_directory, exist_ok=True)
+        cached = os.path.join(cache_directory, os.path.basename(url))
+        response = requests.get(url, stream=True)
+        response.raise_for_status()
+        with open(cached + '.tmp', 'wb') as file_handle:
+            for data in response.iter_content(65536):
+                file_handle.write(data)
+        os.replace(cached + '.tmp', cached)
+        if evict:
+            self.evict(keep=[cached])
+        return version, cached
+
+    def requirements(self, package_name, version):
+        """
+        Get the cached requirements of a package version
+
+        Returns
+        -------
+        list or None
+            The requirement strings, None if they are not cached
+        """
+        cached = os.path.join(self.requirements_directory, package_name + '-' + version + '.json')
+        if os.path.exists(cached):
+            with open(cached) as file_handle:
+                return json.load(file_handle)
+
+    def set_requirements(self, package_name, version, requirements):
+        """
+        Cache the requirements of a package version
+
+        Parameters
+        ----------
+        package_name : str
+            The name of the package
+
+        version : str
+            The version of the package
+
+        requirements : list
+            The requirement strings from the package requires.txt
+        """
+        cached = os.path.join(self.requirements_directory, package_name + '-' + version + '.json')
+        self._write_json(cached, list(requirements))
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used source distributions until the cache
+        is smaller than max_size.
+
+        Parameters
+        ----------
+        keep : list, optional
+            Filenames of source distributions that are in use and must not
+            be removed
+        """
+        keep = set(keep or [])
+        sdists = []
+        for root, dirs, files in os.walk(self.sdist_directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    # Downloads in progress
+                    continue
+                filename = os.path.join(root, name)
+                try:
+                    file_stat = os.stat(filename)
+                except FileNotFoundError:
+                    continue
+                sdists.append((file_stat.st_mtime, file_stat.st_size, filename))
+        total_size = sum(size for mtime, size, filename in sdists)
+        for mtime, size, filename in sorted(sdists):
+            if total_size <= self.max_size:
+                break
+            if filename in keep:
+                continue
+            LOG.debug('Evicting %r from the package cache', filename)
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            total_size -= size
@@ -0,0 +1,282 @@
+"""
+Registry of the boards known to the cloudmanager
+
+The registry is a sorted set of board names scored by the time the board
+was last seen.  It allows the boards to be listed without scanning the
+entire keyspace with KEYS.
+"""
+import logging
+import threading
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+BOARD_REGISTRY_KEY = 'cloudmanager:boards'
+
+# Set by the server monitor loop, which keeps the registry up to date
+SERVER_STATUS_KEY = 'cloudmanager_server:status'
+
+# Boards that have not been seen for this many seconds are dropped from the
+# registry
+REGISTRY_TTL = 86400
+
+# Keyspace notifications needed to see boards come online and go away, the
+# boards refresh their board:<name> key with SETEX and it expires when the
+# board stops responding.  They include the events the board information
+# cache needs to see the boardinfo:<name> keys change.
+PRESENCE_KEYSPACE_EVENTS = 'K$gx'
+
+# Keyspace events on a board key that mean the board has gone away
+BOARD_GONE_EVENTS = ['expired', 'del']
+
+# Pattern of the keyspace notification channels for the board keys
+BOARD_KEYSPACE_PATTERN = '__keyspace@*__:board:*'
+
+# Seconds before a board that keeps refreshing its key is registered again
+REGISTER_INTERVAL = 60
+
+
+def register_boards(redis_db, names, timestamp=None):
+    """
+    Add boards to the registry or update the time they were last seen
+
+    Parameters
+    ----------
+    redis_db : redis.Redis
+        The redis connection
+
+    names : list
+        The names of the boards
+
+    timestamp : float, optional
+        The time the boards were seen, default is the current time
+    """
+    if not names:
+        return
+    if timestamp is None:
+        timestamp = time.time()
+    redis_db.zadd(BOARD_REGISTRY_KEY, {name: timestamp for name in names})
+
+
+def scan_boards(redis_db, cursor=0, count=1000):
+    """
+    Scan part of the keyspace for board keys and add the boards found to the
+    registry.
+
+    Parameters
+    ----------
+    redis_db : redis.Redis
+        The redis connection
+
+    cursor : int, optional
+        The SCAN cursor to continue from, default=0
+
+    count : int, optional
+        The SCAN count hint, default=1000
+
+    Returns
+    -------
+    int
+        The cursor to continue the scan from, 0 once the scan is complete
+    """
+    cursor, keys = redis_db.scan(cursor=cursor, match='board:*', count=count)
+    register_boards(redis_db, [key[6:] for key in keys])
+    return cursor
+
+
+def migrate_registry(redis_db):
+    """
+    Populate the registry from a full SCAN of the keyspace
+
+    Parameters
+    ----------
+    redis_db : redis.Redis
+        The redis connection
+    """
+    cursor = scan_boards(redis_db)
+    while cursor:
+        cursor = scan_boards(redis_db, cursor)
+
+
+def _notification_event(message):
+    """
+    Get the board name and the event from a board key notification
+    """
+    channel = message['channel']
+    event = message['data']
+    if isinstance(channel, bytes):
+        channel = channel.decode()
+    if isinstance(event, bytes):
+        event = event.decode()
+    return channel.split(':board:', 1)[-1], event
+
+
+def watch_registrations(redis_db):
+    """
+    Add boards to the registry as soon as they set their board key, using
+    the keyspace notifications for the board keys, so new boards don't have
+    to wait for the incremental scan to reach them.
+
+    Parameters
+    ----------
+    redis_db : redis.Redis
+        The redis connection
+
+    Returns
+    -------
+    redis.client.PubSubWorkerThread
+        The thread handling the notifications, stop it with its stop()
+        method
+    """
+    # Imported here, the utility module imports the server module which
+    # imports this module
+    from .utility import enable_keyspace_events
+
+    last_registered = {}
+
+    def handle_notification(message):
+        name, event = _notification_event(message)
+        if event != 'set':
+            return
+        now = time.time()
+        if now - last_registered.get(name, 0) < REGISTER_INTERVAL:
+            return
+        last_registered[name] = now
+        register_boards(redis_db, [name], timestamp=now)
+
+    enable_keyspace_events(redis_db, PRESENCE_KEYSPACE_EVENTS)
+    pubsub = redis_db.pubsub(ignore_subscribe_messages=True)
+    pubsub.psubscribe(**{BOARD_KEYSPACE_PATTERN: handle_notification})
+    return pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+
+def registered_board_names(redis_db, check_online=True):
+    """
+    Get the names of the boards in the registry
+
+    Parameters
+    ----------
+    redis_db : redis.Redis
+        The redis connection
+
+    check_online : bool, optional
+        Only return the boards that are currently online, default=True
+
+    Returns
+    -------
+    list
+        The board names
+    """
+    if redis_db.exists(BOARD_REGISTRY_KEY, SERVER_STATUS_KEY) < 2:
+        # Nothing is maintaining the registry, fall back to scanning for boards
+        migrate_registry(redis_db)
+
+    redis_db.zremrangebyscore(BOARD_REGISTRY_KEY, 0, time.time() - REGISTRY_TTL)
+    names = [name.decode() for name in redis_db.zrange(BOARD_REGISTRY_KEY, 0, -1)]
+    if not check_online:
+        return names
+
+    pipeline = redis_db.pipeline(transaction=False)
+    for name in names:
+        pipeline.exists('board:' + name)
+    online = [name for name, exists in zip(names, pipeline.execute()) if exists]
+    register_boards(redis_db, online)
+    return online
+
+
+class BoardPresence(object):
+    """
+    Follow boards coming online and going away using keyspace notifications
+    on the board keys instead of polling the keyspace.
+
+    The notifications are handled in a background thread that blocks while
+    nothing changes.  The callbacks are called from that thread.
+
+    Parameters
+    ----------
+    redis_db : redis.Redis
+        The redis connection
+
+    on_join : callable, optional
+        Called with the board name when a board comes online
+
+    on_leave : callable, optional
+        Called with the board name when a board goes away
+    """
+    def __init__(self, redis_db, on_join=None, on_leave=None):
+        self.redis_db = redis_db
+        self.on_join = on_join
+        self.on_leave = on_leave
+        self._names = set()
+        self._lock = threading.Lock()
+        self._pubsub = None
+        self._watcher = None
+
+    @property
+    def names(self):
+        """
+        The names of the boards that are currently online
+        """
+        with self._lock:
+            return set(self._names)
+
+    def _handle_notification(self, message):
+        name, event = _notification_event(message)
+        with self._lock:
+            if event == 'set' and name not in self._names:
+                self._names.add(name)
+                callback = self.on_join
+            elif event in BOARD_GONE_EVENTS and name in self._names:
+                self._names.discard(name)
+                callback = self.on_leave
+            else:
+                return
+        if event == 'set':
+            register_boards(self.redis_db, [name])
+        if callback:
+            try:
+                callback(name)
+            except Exception:
+                LOG.exception('Board presence callback failed for board %r', name)
+
+    def start(self):
+        """
+        Subscribe to the board key notifications and start the background
+        thread.  The boards that are already online are reported to on_join.
+
+        Returns
+        -------
+        set
+            The names of the boards that are online
+        """
+        # Imported here, the utility module imports the server module which
+        # imports this module
+        from .utility import enable_keyspace_events
+
+        if self._watcher:
+            return self.names
+        enable_keyspace_events(self.redis_db, PRESENCE_KEYSPACE_EVENTS)
+        self._pubsub = self.redis_db.pubsub(ignore_subscribe_messages=True)
+        # Subscribe before listing the boards so no change is missed, the
+        # notifications received in the meantime are queued on the connection
+        self._pubsub.psubscribe(**{BOARD_KEYSPACE_PATTERN: self._handle_notification})
+        for name in registered_board_names(self.redis_db):
+            with self._lock:
+                if name in self._names:
+                    continue
+                self._names.add(name)
+            if self.on_join:
+                self.on_join(name)
+        self._watcher = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+        return self.names
+
+    def stop(self):
+        """
+        Stop following the boards
+        """
+        if self._watcher:
+            self._watcher.stop()
+            self._watcher.join()
+            self._watcher = None
+        self._pubsub = None
@@ -1,10 +1,8 @@
 #!/usr/bin/env python
 from __future__ import print_function
-import daemon
 import logging
-import netifaces
 import time
-import redislite
+from .registry import PRESENCE_KEYSPACE_EVENTS, scan_boards, watch_registrations
 
 
 LOG = logging.getLogger('cloudmanager_server')
@@ -13,6 +11,8 @@ STATUS_KEY = 'cloudmanager_server:status'
 
 
 def get_service_addresses():
+    import netifaces
+
     listen_addresses = []
     for interface in netifaces.interfaces():
         if interface in ['docker0']:
@@ -43,14 +43,23 @@ def run_server(port, rdb_file=None, daemonize=True):
     rdb_file : str, optional
         The redis rdb file to use, default None
     """
+    import daemon
+    import redislite
+
     if not rdb_file:
         rdb_file = RDB_FILE
     listen_addresses = get_service_addresses()
     if listen_addresses:
         print('Cloudmanager service is listening on:', ','.join([addr+':'+str(port) for addr in listen_addresses]))
-        connection = redislite.StrictRedis(dbfilename=rdb_file, serverconfig={'port': str(port), 'bind': listen_addresses[0]})
+        bind_address = listen_addresses[0]
     else:
-        connection = redislite.StrictRedis(dbfilename=rdb_file, serverconfig={'port': str(port), 'bind': '127.0.0.1'})
+        bind_address = '127.0.0.1'
+    # Publish the keyspace notifications used to follow the boards and to
+    # invalidate cached board information
+    connection = redislite.StrictRedis(
+        dbfilename=rdb_file,
+        serverconfig={'port': str(port), 'bind': bind_address, 'notify-keyspace-events': PRESENCE_KEYSPACE_EVENTS}
+    )
 
     if daemonize:
         with daemon.DaemonContext():
@@ -60,16 +69,28 @@ def run_server(port, rdb_file=None, daemonize=True):
 
 
 def monitor_server(rdb_file, ttl=10):
+    import redislite
+
     connection = redislite.StrictRedis(dbfilename=rdb_file)
     status = 'Running'
     connection.setex(STATUS_KEY, ttl, status)
+    # Register new boards as they come online, the scan below picks up the
+    # boards that were online before the server started
+    registration_watcher = watch_registrations(connection)
+    registry_cursor = None
     while status != 'quit':
         status = connection.get(STATUS_KEY)
         status = status.decode()
         LOG.debug(f'Status: {status!r}')
         if not status or connection.ttl(STATUS_KEY) < 2:
             connection.setex(STATUS_KEY, ttl, 'Running')
+        # Incrementally pick up the boards that were already online, the
+        # scan stops after a single pass through the keyspace
+        if registry_cursor != 0:
+            registry_cursor = scan_boards(connection, registry_cursor or 0)
         time.sleep(1)
+    registration_watcher.stop()
+    registration_watcher.join()
     connection.delete(STATUS_KEY)
     connection.shutdown()
     return
@@ -84,6 +105,8 @@ def quit(rdb_file=None):
     rdb_file : str, optional
         The redis rdb_file, default=None
     """
+    import redislite
+
     if not rdb_file:
         rdb_file = RDB_FILE
     retry_count = 10
@@ -105,6 +128,8 @@ def status(rdb_file=None):
     rdb_file : str, optional
         The redis rdb_file, default=None
     """
+    import redislite
+
     if not rdb_file:
         rdb_file = RDB_FILE
     connection = redislite.StrictRedis(dbfilename=rdb_file)
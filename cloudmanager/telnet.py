@@ -3,13 +3,64 @@
 Functions for interacting with he wipy via telnet
 """
 from __future__ import print_function
+import codecs
 import copy
 import json
+import logging
 import os
-import telnetlib
+import selectors
+import socket
+import struct
+import sys
+import threading
 import time
+from .exceptions import BoardError, BoardNotResponding
 
 
+LOG = logging.getLogger(__name__)
+
+TELNET_PORT = 23
+
+# Seconds to wait for each prompt while logging in
+LOGIN_TIMEOUT = 10
+
+# Seconds an unused session is kept open before it is closed
+SESSION_IDLE_TIMEOUT = 60
+
+# Seconds past the idle timeout the idle session timer fires, so the
+# sessions it was started for have expired when it runs
+REAPER_SLACK = 0.1
+
+# Telnet protocol bytes
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+
+# Markers sent by the micropython REPL
+PROMPT = b'>>> '
+LOGIN_PROMPT = b'Login as: '
+PASSWORD_PROMPT = b'assword: '
+RAW_REPL_PROMPT = b'raw REPL; CTRL-B to exit\r\n>'
+RAW_REPL_END = b'\x04>'
+
+# Control characters of the raw REPL
+CTRL_A = b'\x01'
+CTRL_B = b'\x02'
+CTRL_C = b'\x03'
+CTRL_D = b'\x04'
+
+# Raw-paste mode request and the responses of boards that support it and
+# boards that understand the request but don't support it
+RAW_PASTE_REQUEST = b'\x05A\x01'
+RAW_PASTE_SUPPORTED = b'R\x01'
+RAW_PASTE_UNSUPPORTED = b'R\x00'
+# Sent by the board in raw-paste mode when it can receive another window
+RAW_PASTE_WINDOW = b'\x01'
+
 DEFAULT_SETTINGS = dict(
     username='micro',
     password='python',
@@ -35,7 +86,287 @@ def echo_output(output, echo=False):
     print(output, end='')
 
 
-def get_authenticated_connection(echo=False, hostname='192.168.1.1', username='micro', password='python'):
+class TelnetConnection(object):
+    """
+    Telnet client connection that waits for data with a selector
+
+    Reads return as soon as the data they wait for arrives instead of
+    polling, so the latency of a command is only the time the board takes
+    to run it.  Only the option negotiation needed to talk to the wipy is
+    implemented, every option the server asks for is refused.
+
+    Parameters
+    ----------
+    host : str
+        The hostname or IP address to connect to
+
+    port : int, optional
+        The telnet port, default=23
+
+    connect_timeout : float, optional
+        Seconds to wait for the connection, default=10
+    """
+    def __init__(self, host, port=TELNET_PORT, connect_timeout=LOGIN_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.eof = False
+        # If the board supports raw-paste mode, None until it has been tried
+        self.raw_paste = None
+        self._raw = b''
+        self._buffer = b''
+        self.sock = socket.create_connection((host, port), connect_timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.sock, selectors.EVENT_READ)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        """
+        Close the connection
+        """
+        if self.sock:
+            self._selector.close()
+            self.sock.close()
+            self.sock = None
+
+    def write(self, data):
+        """
+        Send data to the server
+
+        Parameters
+        ----------
+        data : bytes or str
+            The data to send
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        self.sock.sendall(data.replace(bytes([IAC]), bytes([IAC, IAC])))
+
+    def _process(self, data):
+        """
+        Strip the telnet commands from received data and refuse the options
+        the server asks for.  An incomplete command at the end of the data is
+        kept until the rest of it arrives.
+        """
+        data = self._raw + data
+        output = bytearray()
+        replies = bytearray()
+        index = 0
+        while index < len(data):
+            position = data.find(bytes([IAC]), index)
+            if position < 0:
+                output += data[index:]
+                index = len(data)
+                break
+            output += data[index:position]
+            index = position
+            if index + 1 >= len(data):
+                break
+            command = data[index + 1]
+            if command == IAC:
+                output.append(IAC)
+                index += 2
+            elif command in [DO, DONT, WILL, WONT]:
+                if index + 2 >= len(data):
+                    break
+                if command == DO:
+                    replies += bytes([IAC, WONT, data[index + 2]])
+                elif command == WILL:
+                    replies += bytes([IAC, DONT, data[index + 2]])
+                index += 3
+            elif command == SB:
+                end = data.find(bytes([IAC, SE]), index + 2)
+                if end < 0:
+                    break
+                index = end + 2
+            else:
+                index += 2
+        self._raw = data[index:]
+        self._buffer += bytes(output)
+        if replies:
+            self.sock.sendall(bytes(replies))
+
+    def _fill(self, timeout=None):
+        """
+        Wait up to timeout seconds for data and add it to the buffer
+
+        Returns
+        -------
+        bool
+            True if data was received
+        """
+        if self.eof or not self._selector.select(timeout):
+            return False
+        data = self.sock.recv(4096)
+        if not data:
+            self.eof = True
+            return False
+        self._process(data)
+        return True
+
+    def _remaining(self, deadline):
+        if deadline is None:
+            return
+        return max(deadline - time.monotonic(), 0)
+
+    def _check_wait(self, expected, deadline, timeout):
+        if self.eof:
+            raise EOFError('The telnet connection to %s was closed' % self.host)
+        if deadline is not None and time.monotonic() >= deadline:
+            raise BoardNotResponding('%s did not send %s within %s seconds' % (self.host, expected, timeout))
+
+    def pending(self):
+        """
+        Check if there is received data that has not been read, without
+        waiting
+
+        Returns
+        -------
+        bool
+            True if there is data to read
+        """
+        self._fill(0)
+        return bool(self._buffer)
+
+    def read(self, num_bytes, timeout=None):
+        """
+        Read exactly num_bytes bytes
+
+        Parameters
+        ----------
+        num_bytes : int
+            The number of bytes to read
+
+        timeout : float, optional
+            Seconds to wait, default None waits until the bytes are received
+
+        Returns
+        -------
+        bytes
+            The data
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self._buffer) < num_bytes:
+            self._check_wait('%d bytes' % num_bytes, deadline, timeout)
+            self._fill(self._remaining(deadline))
+        data, self._buffer = self._buffer[:num_bytes], self._buffer[num_bytes:]
+        return data
+
+    def expect(self, markers, timeout=None):
+        """
+        Read until one of the markers is received
+
+        Parameters
+        ----------
+        markers : list
+            The byte strings to wait for
+
+        timeout : float, optional
+            Seconds to wait, default None waits until a marker is received
+
+        Returns
+        -------
+        tuple
+            The index of the marker that was received and the data up to and
+            including the marker
+
+        Raises
+        ------
+        BoardNotResponding
+            No marker was received within the timeout
+
+        EOFError
+            The connection was closed before a marker was received
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            found = [
+                (self._buffer.find(marker), index, marker) for index, marker in enumerate(markers)
+                if marker in self._buffer
+            ]
+            if found:
+                position, index, marker = min(found)
+                end = position + len(marker)
+                data, self._buffer = self._buffer[:end], self._buffer[end:]
+                return index, data
+            self._check_wait(repr(markers), deadline, timeout)
+            self._fill(self._remaining(deadline))
+
+    def read_until(self, marker, timeout=None):
+        """
+        Read until marker is received
+
+        Parameters
+        ----------
+        marker : bytes
+            The byte string to wait for
+
+        timeout : float, optional
+            Seconds to wait, default None waits until the marker is received
+
+        Returns
+        -------
+        bytes
+            The data up to and including the marker
+        """
+        return self.expect([marker], timeout=timeout)[1]
+
+    def read_stream(self, marker, timeout=None):
+        """
+        Generator that yields the data as it is received until marker is
+        received.  The marker is consumed but not yielded.
+
+        Parameters
+        ----------
+        marker : bytes
+            The byte string that ends the stream
+
+        timeout : float, optional
+            Seconds to wait for the marker, default None waits until the
+            marker is received
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            position = self._buffer.find(marker)
+            if position >= 0:
+                data, self._buffer = self._buffer[:position], self._buffer[position + len(marker):]
+                if data:
+                    yield data
+                return
+            # Hold back enough bytes to match a marker split across reads
+            available = len(self._buffer) - len(marker) + 1
+            if available > 0:
+                data, self._buffer = self._buffer[:available], self._buffer[available:]
+                yield data
+            self._check_wait(repr(marker), deadline, timeout)
+            self._fill(self._remaining(deadline))
+
+    def read_very_eager(self):
+        """
+        Read all of the data that is available without waiting
+
+        Returns
+        -------
+        bytes
+            The data, empty if nothing is available
+
+        Raises
+        ------
+        EOFError
+            The connection is closed and there is no data left
+        """
+        while self._fill(0):
+            pass
+        data, self._buffer = self._buffer, b''
+        if not data and self.eof:
+            raise EOFError('The telnet connection to %s was closed' % self.host)
+        return data
+
+
+def get_authenticated_connection(echo=False, hostname='192.168.1.1', username='micro', password='python',
+                                 timeout=LOGIN_TIMEOUT):
     """
     Get a telnet connection to the wipy and authenticate
     with the username and password from the settings.
@@ -49,55 +380,260 @@ def get_authenticated_connection(echo=False, hostname='192.168.1.1', username='m
         The hostname or IP address to connect to.  If not provided
         will use the value from the sttings.
 
+    timeout : float, optional
+        Seconds to wait for each login prompt, default=10
+
     Returns
     -------
-    telnetlib.Telnet
-        Returns a telnetlib.Telnet connection object
-    """
-    tn = telnetlib.Telnet()
-    tn.open(hostname)
-    echo_output(tn.read_until(b"Login as: ", timeout=2).decode(), echo)
-    time.sleep(.5)
-    tn.write(username + b'\r')
-    echo_output(tn.read_until(b'assword: ', timeout=2).decode(), echo)
-    time.sleep(.5)
-    tn.write(password + b'\r')
-    echo_output(tn.read_until(b'>>> ', timeout=2).decode(), echo)
-    echo_output(tn.read_very_eager().decode(), echo)
+    TelnetConnection
+        Returns an authenticated TelnetConnection
+    """
+    if isinstance(username, str):
+        username = username.encode()
+    if isinstance(password, str):
+        password = password.encode()
+    tn = TelnetConnection(hostname, connect_timeout=timeout)
+    try:
+        echo_output(tn.read_until(LOGIN_PROMPT, timeout=timeout).decode(), echo)
+        tn.write(username + b'\r')
+        echo_output(tn.read_until(PASSWORD_PROMPT, timeout=timeout).decode(), echo)
+        tn.write(password + b'\r')
+        index, output = tn.expect([PROMPT, LOGIN_PROMPT], timeout=timeout)
+        echo_output(output.decode(), echo)
+        if index:
+            raise BoardError('Login to %s as %r failed' % (hostname, username.decode()))
+    except Exception:
+        tn.close()
+        raise
     return tn
 
 
+def enter_raw_repl(tn, timeout=LOGIN_TIMEOUT):
+    """
+    Switch the REPL of an authenticated connection to the raw REPL
+
+    Parameters
+    ----------
+    tn : TelnetConnection
+        The connection, at the friendly REPL prompt
+
+    timeout : float, optional
+        Seconds to wait for the raw REPL prompt, default=10
+    """
+    # Discard the output of anything that ran before
+    tn.read_very_eager()
+    tn.write(b'\r' + CTRL_A)
+    tn.read_until(RAW_REPL_PROMPT, timeout=timeout)
+
+
+def exit_raw_repl(tn, timeout=LOGIN_TIMEOUT):
+    """
+    Switch the REPL of a connection from the raw REPL back to the friendly
+    REPL
+
+    Parameters
+    ----------
+    tn : TelnetConnection
+        The connection, at the raw REPL prompt
+
+    timeout : float, optional
+        Seconds to wait for the friendly REPL prompt, default=10
+    """
+    tn.write(b'\r' + CTRL_B)
+    tn.read_until(PROMPT, timeout=timeout)
+
+
+def raw_paste_write(tn, data, timeout=LOGIN_TIMEOUT):
+    """
+    Send the code to run in raw-paste mode, the board has accepted the
+    raw-paste request.
+
+    The board sends the size of its receive window and then a byte each
+    time another window of data can be sent, so the board never has to
+    buffer more than it has room for.
+
+    Parameters
+    ----------
+    tn : TelnetConnection
+        The connection
+
+    data : bytes
+        The code to run
+
+    timeout : float, optional
+        Seconds to wait for the board to accept more data, default=10
+    """
+    window_size = struct.unpack('<H', tn.read(2, timeout=timeout))[0]
+    window_remaining = window_size
+    position = 0
+    while position < len(data):
+        while window_remaining == 0 or tn.pending():
+            control = tn.read(1, timeout=timeout)
+            if control == RAW_PASTE_WINDOW:
+                window_remaining += window_size
+            elif control == CTRL_D:
+                # The board stopped reading early, acknowledge it
+                tn.write(CTRL_D)
+                return
+            else:
+                raise BoardError('Unexpected %r from %s during raw paste' % (control, tn.host))
+        chunk = data[position:position + window_remaining]
+        tn.write(chunk)
+        window_remaining -= len(chunk)
+        position += len(chunk)
+    tn.write(CTRL_D)
+    tn.read_until(CTRL_D, timeout=timeout)
+
+
+def raw_send(tn, command, timeout=LOGIN_TIMEOUT):
+    """
+    Send code to run from the raw REPL prompt
+
+    Raw-paste mode is used if the board supports it, otherwise the code is
+    sent to the standard raw REPL in a single write.  Once this returns the
+    board is running the code and its stdout followed by CTRL-D, its stderr
+    followed by CTRL-D and the raw REPL prompt can be read from the
+    connection.
+
+    Parameters
+    ----------
+    tn : TelnetConnection
+        The connection, at the raw REPL prompt
+
+    command : str or bytes
+        The code to run
+
+    timeout : float, optional
+        Seconds to wait for the board to accept the code, default=10
+    """
+    if isinstance(command, str):
+        command = command.encode()
+    if tn.raw_paste is not False:
+        tn.write(RAW_PASTE_REQUEST)
+        response = tn.read(2, timeout=timeout)
+        if response == RAW_PASTE_SUPPORTED:
+            tn.raw_paste = True
+            raw_paste_write(tn, command, timeout=timeout)
+            return
+        tn.raw_paste = False
+        if response != RAW_PASTE_UNSUPPORTED:
+            # Firmware older than raw-paste mode re-enters the raw REPL
+            tn.read_until(RAW_REPL_PROMPT[2:], timeout=timeout)
+    tn.write(command + CTRL_D)
+    response = tn.read(2, timeout=timeout)
+    if response != b'OK':
+        raise BoardError('%s could not execute the command, it responded %r' % (tn.host, response))
+
+
+def raw_execute(tn, command, timeout=None):
+    """
+    Run code from the raw REPL prompt and wait for it to complete
+
+    Parameters
+    ----------
+    tn : TelnetConnection
+        The connection, at the raw REPL prompt
+
+    command : str or bytes
+        The code to run
+
+    timeout : float, optional
+        Seconds to wait for the code to complete, default None waits until
+        it completes
+
+    Returns
+    -------
+    tuple
+        The stdout and stderr output of the code
+    """
+    raw_send(tn, command)
+    stdout = tn.read_until(CTRL_D, timeout=timeout)[:-1]
+    stderr = tn.read_until(CTRL_D, timeout=timeout)[:-1]
+    tn.read_until(b'>', timeout=timeout)
+    return stdout, stderr
+
+
+def execute(command, hostname, username='micro', password='python', timeout=None):
+    """
+    Run code on a board through the raw REPL of a pooled session
+
+    Parameters
+    ----------
+    command : str or bytes
+        The code to run
+
+    hostname : str
+        The hostname or IP address of the board
+
+    username : str, optional
+        The login username, default=micro
+
+    password : str, optional
+        The login password, default=python
+
+    timeout : float, optional
+        Seconds to wait for the code to complete, default None waits until
+        it completes
+
+    Returns
+    -------
+    tuple
+        The stdout and stderr output of the code
+    """
+    tn = SESSION_POOL.get(hostname, username=username, password=password)
+    try:
+        enter_raw_repl(tn)
+        output = raw_execute(tn, command, timeout=timeout)
+        exit_raw_repl(tn)
+    except BoardNotResponding:
+        # Interrupt the code that is still running before dropping the
+        # session
+        try:
+            tn.write(CTRL_C)
+        except OSError:
+            pass
+        tn.close()
+        raise
+    except Exception:
+        # The state of the REPL is unknown, don't reuse the session
+        tn.close()
+        raise
+    SESSION_POOL.release(tn, username=username, password=password)
+    return output
+
+
 def send_command(command, echo=False, hostname=None):
     """
-    Send a single command to the wipy
+    Run a command or script on the wipy through the raw REPL, the output
+    is printed as it is received and the error output is printed to
+    stderr.
 
     Parameters
     ----------
     command : str
-        The command to run on the wipy console
+        The code to run on the wipy
 
     echo : bool
-        Echo the session output when runing the command.  Default=False
+        Echo the login output.  Default=False
 
     hostname : str,optional
         The hostname or IP address to connect to.  If not provided
         will use the value from the sttings.
     """
-    if isinstance(command, str):
-        command = command.encode()
     tn = get_authenticated_connection(echo=echo, hostname=hostname)
-    tn.write(command + b'\r')
-    echo_output(tn.read_until(command + b'\r\n'), echo)
-    output = tn.read_until(b'>>> ').decode()
-    if '>>> ' in output:
-        output = output[:-4]
-    print(output, end='')
-    output = tn.read_very_eager()
-    while output:
-        print(output.decode(), end="")
-        time.sleep(.5)
-        output = tn.read_very_eager()
-    tn.close()
+    try:
+        enter_raw_repl(tn)
+        raw_send(tn, command)
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        for output in tn.read_stream(CTRL_D):
+            print(decoder.decode(output), end='')
+        print(decoder.decode(b'', final=True), end='')
+        stderr = tn.read_until(CTRL_D)[:-1]
+        print(stderr.decode(errors='replace'), end='', file=sys.stderr)
+        tn.read_until(b'>')
+        exit_raw_repl(tn)
+    finally:
+        tn.close()
 
 
 def console(hostname=None, echo=False):
@@ -117,7 +653,7 @@ def console(hostname=None, echo=False):
     while True:
         command = input('>>> ').encode() + b'\r'
         tn.write(command)
-        output = tn.read_until(b'>>> ', timeout=2).decode()
+        output = tn.read_until(PROMPT).decode()
         if output.startswith(command.decode()):
             output = output[len(command) + 1:]
         if '>>> ' in output:
@@ -125,6 +661,155 @@ def console(hostname=None, echo=False):
         echo_output(output, True)
 
 
+class TelnetSessionPool(object):
+    """
+    Pool of authenticated telnet sessions keyed by hostname
+
+    Logging in to the wipy takes a round trip for each prompt, reusing the
+    sessions means repeated commands only pay for the command itself.
+    Sessions are checked for liveness before they are handed out and
+    sessions that have not been used for idle_timeout seconds are closed by
+    a background timer, even if the pool is not used again.
+
+    Parameters
+    ----------
+    idle_timeout : int, optional
+        Seconds an unused session is kept open, default=60
+    """
+    def __init__(self, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def _is_alive(self, session):
+        """
+        Check that the other end has not closed the session and discard any
+        output left over from earlier commands.
+        """
+        try:
+            # Raises EOFError once the connection is closed
+            session.read_very_eager()
+        except (EOFError, OSError):
+            return False
+        return True
+
+    def _evict_idle(self):
+        now = time.time()
+        expired = []
+        with self._lock:
+            for key, sessions in list(self._sessions.items()):
+                idle = [(session, last_used) for session, last_used in sessions if now - last_used > self.idle_timeout]
+                for entry in idle:
+                    sessions.remove(entry)
+                expired += [session for session, last_used in idle]
+                if not sessions:
+                    del self._sessions[key]
+        for session in expired:
+            LOG.debug('Closing idle telnet session to %r', session.host)
+            session.close()
+
+    def _schedule_reaper(self):
+        """
+        Start a timer to close the pooled sessions when the oldest of them
+        becomes idle, if one is not already running.  Must be called with
+        the lock held.
+        """
+        if self._reaper or not self._sessions:
+            return
+        oldest = min(last_used for sessions in self._sessions.values() for session, last_used in sessions)
+        delay = max(oldest + self.idle_timeout - time.time(), 0) + REAPER_SLACK
+        self._reaper = threading.Timer(delay, self._reap)
+        self._reaper.daemon = True
+        self._reaper.start()
+
+    def _reap(self):
+        """
+        Close the idle sessions and reschedule the timer for the sessions
+        that remain
+        """
+        with self._lock:
+            self._reaper = None
+        self._evict_idle()
+        with self._lock:
+            self._schedule_reaper()
+
+    def get(self, hostname, username='micro', password='python'):
+        """
+        Get an authenticated session, the session must be returned with
+        release() when it is no longer used.
+
+        Parameters
+        ----------
+        hostname : str
+            The hostname or IP address of the board
+
+        username : str, optional
+            The login username, default=micro
+
+        password : str, optional
+            The login password, default=python
+
+        Returns
+        -------
+        TelnetConnection
+            The authenticated telnet connection
+        """
+        if isinstance(hostname, bytes):
+            hostname = hostname.decode()
+        self._evict_idle()
+        key = (hostname, username, password)
+        while True:
+            with self._lock:
+                sessions = self._sessions.get(key)
+                if not sessions:
+                    break
+                session, last_used = sessions.pop()
+            if self._is_alive(session):
+                return session
+            LOG.debug('Telnet session to %r was closed, reconnecting', hostname)
+            session.close()
+        return get_authenticated_connection(hostname=hostname, username=username, password=password)
+
+    def release(self, session, username='micro', password='python'):
+        """
+        Return a session to the pool
+
+        Parameters
+        ----------
+        session : TelnetConnection
+            The session returned by get()
+
+        username : str, optional
+            The login username the session was created with, default=micro
+
+        password : str, optional
+            The login password the session was created with, default=python
+        """
+        if not session.sock:
+            return
+        with self._lock:
+            self._sessions.setdefault((session.host, username, password), []).append((session, time.time()))
+            self._schedule_reaper()
+        self._evict_idle()
+
+    def close(self):
+        """
+        Close all of the sessions in the pool
+        """
+        with self._lock:
+            sessions = [session for sessions in self._sessions.values() for session, last_used in sessions]
+            self._sessions = {}
+            if self._reaper:
+                self._reaper.cancel()
+                self._reaper = None
+        for session in sessions:
+            session.close()
+
+
+SESSION_POOL = TelnetSessionPool()
+
+
 def get_config_settings(conf_file='~/.config/micropython'):
     """
     Get a set of configuration settings based on the default values
@@ -1,9 +1,36 @@
 """
 Basic utility functions
 """
-import redislite
+import json
+import os
+import threading
 from .server import RDB_FILE
 
+
+CACHE_DIRECTORY = os.path.expanduser('~/.cache/cloudmanager')
+
+# The rc file holding the settings of the command line tools
+RC_CONFIG_FILE = os.path.expanduser('~/.micropython_bootconfig.json')
+
+# Environment variable with the URL of a remote cloudmanager redis server
+REDIS_URL_ENVIRONMENT_VARIABLE = 'CLOUDMANAGER_REDIS_URL'
+
+# Maximum number of connections in the shared client's connection pool,
+# threads wait for a free connection once they are all in use
+REDIS_MAX_CONNECTIONS = int(os.environ.get('CLOUDMANAGER_REDIS_MAX_CONNECTIONS', 64))
+
+# Connections idle for this many seconds are checked with a PING before use
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('CLOUDMANAGER_REDIS_HEALTH_CHECK_INTERVAL', 30))
+
+_redis_clients = {}
+_redis_client_pid = None
+# The URL returned by redis_url(), resolved once per process because it
+# reads the rc file
+_configured_redis_url = None
+_configured_redis_url_resolved = False
+_redis_client_lock = threading.Lock()
+
+
 def header(message, width=80):
     header_message = '## ' + message + ' '
     end_chars = width - (len(message) + 4)
@@ -11,9 +38,146 @@ def header(message, width=80):
     print(header_message)
 
 
-def connect_to_redis():
-    return redislite.Redis(dbfilename=RDB_FILE)
-    host = read_rc_config()["settings"].get('redis_server', '127.0.0.1')
-    port = read_rc_config()["settings"].get('redis_port', '18266')
-    port = int(port)
-    return redis.Redis(host=host, port=port)
+def enable_keyspace_events(redis_db, flags):
+    """
+    Make sure the redis server publishes the keyspace notifications
+    needed by a subscriber.
+
+    Parameters
+    ----------
+    redis_db : redis.Redis
+        The redis connection
+
+    flags : str
+        The notify-keyspace-events flags to enable in addition to the
+        ones already enabled
+    """
+    current = redis_db.config_get('notify-keyspace-events').get('notify-keyspace-events', '')
+    if isinstance(current, bytes):
+        current = current.decode()
+    missing = ''.join(flag for flag in flags if flag not in current)
+    if missing:
+        redis_db.config_set('notify-keyspace-events', current + missing)
+
+
+def read_rc_config():
+    """
+    Read the rc file of the command line tools
+
+    Returns
+    -------
+    dict
+        The rc configuration, empty if there is no rc file
+    """
+    rc_config = {}
+    if os.path.exists(RC_CONFIG_FILE):
+        with open(RC_CONFIG_FILE) as read_fh:
+            rc_config = json.load(read_fh)
+    return rc_config
+
+
+def redis_url():
+    """
+    Get the URL of the remote cloudmanager redis server to connect to
+
+    The URL is taken from the CLOUDMANAGER_REDIS_URL environment variable,
+    then the redis_url setting in the rc file and then the redis_server and
+    redis_port settings in the rc file.
+
+    Returns
+    -------
+    str or None
+        The redis URL, None to use the local redislite server
+    """
+    url = os.environ.get(REDIS_URL_ENVIRONMENT_VARIABLE)
+    if url:
+        return url
+    settings = read_rc_config().get('settings', {})
+    if settings.get('redis_url'):
+        return settings['redis_url']
+    if settings.get('redis_server'):
+        return 'redis://%s:%s/0' % (settings['redis_server'], settings.get('redis_port', '18266'))
+
+
+def _create_client(url, max_connections, health_check_interval):
+    # Imported here so commands that don't talk to the server start quickly
+    import redis
+
+    if url:
+        pool = redis.BlockingConnectionPool.from_url(
+            url, max_connections=max_connections, health_check_interval=health_check_interval, timeout=None
+        )
+        return redis.Redis(connection_pool=pool)
+
+    import redislite
+
+    client = redislite.Redis(dbfilename=RDB_FILE)
+    # Replace the default pool, which raises an error instead of waiting
+    # when it runs out of connections
+    client.connection_pool.disconnect()
+    client.connection_pool = redis.BlockingConnectionPool(
+        connection_class=redis.UnixDomainSocketConnection, path=client.socket_file,
+        max_connections=max_connections, health_check_interval=health_check_interval, timeout=None
+    )
+    return client
+
+
+def connect_to_redis(shared=True, max_connections=None, health_check_interval=None, url=None):
+    """
+    Get a connection to the cloudmanager redis server
+
+    If a redis URL is configured the client connects to that server
+    directly over TCP or a unix socket, otherwise the local redislite server
+    is started or attached to.  By default a single process wide client is
+    returned and later calls reuse the client and its connection pool.
+    After a fork the child process resets the connection pool so
+    connections are never shared between processes.
+
+    Parameters
+    ----------
+    shared : bool, optional
+        Return the process wide client, default=True.  If False a new
+        client with its own connection pool is returned.
+
+    max_connections : int, optional
+        Size of the connection pool, default REDIS_MAX_CONNECTIONS.  Only
+        used when the client is created.
+
+    health_check_interval : int, optional
+        Seconds a connection can be idle before it is checked before use,
+        default REDIS_HEALTH_CHECK_INTERVAL.  Only used when the client is
+        created.
+
+    url : str, optional
+        The redis URL to connect to, for example redis://host:18266/0 or
+        unix:///path/to/redis.socket, default is the URL returned by
+        redis_url(), which is only looked up by the first call
+
+    Returns
+    -------
+    redis.Redis
+        The redis client, a redislite.Redis for the local server
+    """
+    global _configured_redis_url, _configured_redis_url_resolved, _redis_client_pid
+
+    max_connections = max_connections or REDIS_MAX_CONNECTIONS
+    if health_check_interval is None:
+        health_check_interval = REDIS_HEALTH_CHECK_INTERVAL
+    if url is None:
+        if not _configured_redis_url_resolved:
+            _configured_redis_url = redis_url()
+            _configured_redis_url_resolved = True
+        url = _configured_redis_url
+
+    if not shared:
+        return _create_client(url, max_connections, health_check_interval)
+
+    with _redis_client_lock:
+        if _redis_client_pid != os.getpid():
+            # Forked, don't use the parent's connections
+            for client in _redis_clients.values():
+                client.connection_pool.reset()
+            _redis_client_pid = os.getpid()
+        if url not in _redis_clients:
+            _redis_clients[url] = _create_client(url, max_connections, health_check_interval)
+        return _redis_clients[url]
@@ -16,6 +16,7 @@ setup(
         'python_version>="3.6"',
         'hostlists',
         'redislite',
+        'redis>=5.0.1',
         'python-daemon',
         'pip>=8.1.2',
         'netifaces',
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import unittest
+sys.path.insert(0, '.')
+from cloudmanager.installer import (
+    Package, deployment_plan, package_files, parse_requirement, read_requirements, resolve_dependencies
+)
+
+
+def make_sdist(directory, name, version, files, requires=None):
+    """
+    Create a source distribution holding files, a dictionary mapping the
+    filenames relative to the package directory to their contents
+    """
+    base = '%s-%s' % (name, version)
+    files = dict(files)
+    files['setup.py'] = b''
+    files['PKG-INFO'] = b''
+    if requires is not None:
+        files[name + '.egg-info/requires.txt'] = requires.encode()
+    sdist = os.path.join(directory, base + '.tar.gz')
+    with tarfile.open(sdist, 'w:gz') as tar:
+        for filename, data in sorted(files.items()):
+            info = tarfile.TarInfo(base + '/' + filename)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return sdist
+
+
+class ParseRequirementTestCase(unittest.TestCase):
+    def test_name(self):
+        self.assertEqual(parse_requirement('micropython-os'), ('micropython-os', None))
+
+    def test_pinned_version(self):
+        self.assertEqual(parse_requirement('micropython-os==0.4'), ('micropython-os', '0.4'))
+
+    def test_whitespace(self):
+        self.assertEqual(parse_requirement('  micropython-os == 0.4 '), ('micropython-os', '0.4'))
+
+    def test_range_is_not_pinned(self):
+        self.assertEqual(parse_requirement('micropython-os>=0.4,<1'), ('micropython-os', None))
+
+    def test_extras_and_markers(self):
+        self.assertEqual(parse_requirement('micropython-os[extra]'), ('micropython-os', None))
+        self.assertEqual(parse_requirement('micropython-os==0.4; python_version>"3"'), ('micropython-os', '0.4'))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            parse_requirement('==0.4')
+
+
+class PackageFilesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_package_files(self):
+        sdist = make_sdist(self.directory, 'micropython-os', '0.4', {'os/__init__.py': b'', 'os/path.py': b''})
+        self.assertEqual(
+            sorted(package_files(sdist)),
+            [('micropython-os-0.4/os/__init__.py', 'os/__init__.py'), ('micropython-os-0.4/os/path.py', 'os/path.py')]
+        )
+
+    def test_read_requirements_ignores_extras(self):
+        sdist = make_sdist(
+            self.directory, 'micropython-os', '0.4', {'os.py': b''},
+            requires='micropython-errno\n\nmicropython-stat==0.5\n[test]\nmicropython-unittest\n'
+        )
+        self.assertEqual(read_requirements(sdist), ['micropython-errno', 'micropython-stat==0.5'])
+
+    def test_read_requirements_without_requires(self):
+        sdist = make_sdist(self.directory, 'micropython-os', '0.4', {'os.py': b''})
+        self.assertEqual(read_requirements(sdist), [])
+
+
+class DeploymentPlanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_plan_deduplicates_files(self):
+        first = Package('first', '1.0', make_sdist(self.directory, 'first', '1.0', {'a.py': b'', 'shared.py': b''}))
+        second = Package(
+            'second', '1.0', make_sdist(self.directory, 'second', '1.0', {'b.py': b'', 'shared.py': b''})
+        )
+        plan = deployment_plan([first, second])
+        self.assertEqual(
+            sorted((package.name, dest) for package, member_name, dest in plan),
+            [('first', 'lib/a.py'), ('first', 'lib/shared.py'), ('second', 'lib/b.py')]
+        )
+
+    def test_plan_prefix(self):
+        package = Package('first', '1.0', make_sdist(self.directory, 'first', '1.0', {'a.py': b''}))
+        self.assertEqual(deployment_plan([package], prefix='flash/lib'), [(package, 'first-1.0/a.py', 'flash/lib/a.py')])
+
+
+class FakePackageCache(object):
+    """
+    Package cache holding the versions and requirements of packages in
+    memory
+    """
+    def __init__(self, packages):
+        self.packages = packages
+        self.resolved = []
+
+    def resolve_version(self, package_name, version=None):
+        self.resolved.append(package_name)
+        return version or sorted(self.packages[package_name].keys())[-1]
+
+    def requirements(self, package_name, version):
+        return self.packages[package_name][version]
+
+
+class ResolveDependenciesTestCase(unittest.TestCase):
+    def test_each_package_is_resolved_once(self):
+        package_cache = FakePackageCache({
+            'app': {'1.0': ['left', 'right']},
+            'left': {'1.0': ['shared']},
+            'right': {'1.0': ['shared==2.0']},
+            'shared': {'1.0': [], '2.0': []},
+        })
+        packages = resolve_dependencies(package_cache, ['app'])
+        self.assertEqual([package.name for package in packages], ['app', 'left', 'right', 'shared'])
+        self.assertEqual(sorted(package_cache.resolved), ['app', 'left', 'right', 'shared'])
+
+    def test_excluded_packages(self):
+        package_cache = FakePackageCache({'app': {'1.0': ['installed']}, 'installed': {'1.0': []}})
+        packages = resolve_dependencies(package_cache, ['app'], exclude=['installed'])
+        self.assertEqual([package.name for package in packages], ['app'])
+
+    def test_pinned_version(self):
+        package_cache = FakePackageCache({'app': {'1.0': [], '2.0': []}})
+        packages = resolve_dependencies(package_cache, ['app==1.0'])
+        self.assertEqual([(package.name, package.version) for package in packages], [('app', '1.0')])
+
+
+if __name__ == '__main__':
+    unittest.main()
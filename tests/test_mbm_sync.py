@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import importlib.machinery
+import importlib.util
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+sys.path.insert(0, '.')
+
+
+def load_mbm_sync():
+    """
+    Import the mbm_sync script as a module
+    """
+    filename = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts', 'mbm_sync')
+    loader = importlib.machinery.SourceFileLoader('mbm_sync', filename)
+    spec = importlib.util.spec_from_loader('mbm_sync', loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+mbm_sync = load_mbm_sync()
+
+DEBOUNCE_INTERVAL = .1
+
+
+class RecordingSyncQueue(mbm_sync.SyncQueue):
+    """
+    SyncQueue that records the batches instead of syncing them to boards,
+    the batches block until release is set.
+    """
+    def __init__(self, *args, **kwargs):
+        self.batches = queue.Queue()
+        self.release = threading.Event()
+        self.release.set()
+        super(RecordingSyncQueue, self).__init__(*args, **kwargs)
+
+    def sync(self, board, batch):
+        self.batches.put((board, sorted(batch), time.time()))
+        self.release.wait()
+
+
+class SyncQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # The batches are recorded, the workers don't need to connect to the
+        # boards
+        self.board_class = mbm_sync.MicropythonBoard
+        mbm_sync.MicropythonBoard = lambda name: name
+        self.sync_queue = RecordingSyncQueue(self.directory, debounce_interval=DEBOUNCE_INTERVAL)
+
+    def tearDown(self):
+        self.sync_queue.release.set()
+        self.sync_queue.stop()
+        mbm_sync.MicropythonBoard = self.board_class
+        shutil.rmtree(self.directory)
+
+    def path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def next_batch(self, timeout=2):
+        return self.sync_queue.batches.get(timeout=timeout)
+
+    def assertNoBatch(self, timeout=DEBOUNCE_INTERVAL * 3):
+        with self.assertRaises(queue.Empty):
+            self.sync_queue.batches.get(timeout=timeout)
+
+    def test_board_file(self):
+        self.assertEqual(self.sync_queue.board_file(self.path('board1', 'lib', 'a.py')), ('board1', 'lib/a.py'))
+        self.assertEqual(self.sync_queue.board_file(self.path('a.py')), (None, None))
+        self.assertEqual(self.sync_queue.board_file(self.path('board1', '.a.py.swp')), (None, None))
+        self.assertEqual(self.sync_queue.board_file(self.path('board1', 'a.py~')), (None, None))
+        self.assertEqual(self.sync_queue.board_file(os.path.join(tempfile.gettempdir(), 'a.py')), (None, None))
+
+    def test_ignored_files_are_not_queued(self):
+        self.sync_queue.add('upload', self.path('board1', 'a.py.tmp'))
+        self.assertNoBatch()
+
+    def test_events_for_a_file_are_coalesced(self):
+        filename = self.path('board1', 'main.py')
+        started = time.time()
+        for action in ['upload', 'upload', 'upload', 'remove']:
+            self.sync_queue.add(action, filename)
+        board, batch, synced = self.next_batch()
+        self.assertEqual((board, batch), ('board1', [('remove', filename, 'main.py')]))
+        self.assertGreaterEqual(synced - started, DEBOUNCE_INTERVAL)
+        self.assertNoBatch()
+
+    def test_debounce_restarts_on_each_event(self):
+        filename = self.path('board1', 'main.py')
+        started = time.time()
+        for _ in range(3):
+            self.sync_queue.add('upload', filename)
+            time.sleep(DEBOUNCE_INTERVAL / 2)
+        board, batch, synced = self.next_batch()
+        self.assertEqual(batch, [('upload', filename, 'main.py')])
+        self.assertGreaterEqual(synced - started, DEBOUNCE_INTERVAL * 2)
+
+    def test_changes_are_batched_per_board(self):
+        self.sync_queue.add('upload', self.path('board1', 'a.py'))
+        self.sync_queue.add('upload', self.path('board1', 'b.py'))
+        self.sync_queue.add('remove', self.path('board2', 'c.py'))
+        batches = dict((board, batch) for board, batch, synced in [self.next_batch(), self.next_batch()])
+        self.assertEqual(batches, {
+            'board1': [
+                ('upload', self.path('board1', 'a.py'), 'a.py'), ('upload', self.path('board1', 'b.py'), 'b.py')
+            ],
+            'board2': [('remove', self.path('board2', 'c.py'), 'c.py')],
+        })
+
+    def test_one_batch_per_board_at_a_time(self):
+        self.sync_queue.release.clear()
+        self.sync_queue.add('upload', self.path('board1', 'a.py'))
+        self.assertEqual(self.next_batch()[0], 'board1')
+        self.sync_queue.add('upload', self.path('board1', 'b.py'))
+        self.sync_queue.add('upload', self.path('board2', 'c.py'))
+        # Other boards are not held up by the busy board
+        self.assertEqual(self.next_batch()[0], 'board2')
+        self.assertNoBatch()
+        self.sync_queue.release.set()
+        board, batch, synced = self.next_batch()
+        self.assertEqual((board, batch), ('board1', [('upload', self.path('board1', 'b.py'), 'b.py')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import socket
+import sys
+import threading
+import time
+import unittest
+sys.path.insert(0, '.')
+from cloudmanager.exceptions import BoardNotResponding
+from cloudmanager.telnet import DO, DONT, IAC, PROMPT, RAW_REPL_END, SB, SE, WILL, WONT, TelnetConnection
+
+
+class TelnetConnectionTestCase(unittest.TestCase):
+    """
+    Tests of the telnet protocol handling against a local socket server
+    """
+    def setUp(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self.connection = TelnetConnection('127.0.0.1', port=listener.getsockname()[1])
+        self.server, address = listener.accept()
+        listener.close()
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.close()
+
+    def send_later(self, *parts, delay=.05):
+        """
+        Send each part from the server after a delay, so they arrive in
+        separate reads
+        """
+        def send():
+            for part in parts:
+                time.sleep(delay)
+                self.server.sendall(part)
+
+        thread = threading.Thread(target=send)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def received(self, num_bytes):
+        data = b''
+        self.server.settimeout(2)
+        while len(data) < num_bytes:
+            data += self.server.recv(num_bytes - len(data))
+        return data
+
+    def test_write_escapes_iac(self):
+        self.connection.write(b'a' + bytes([IAC]) + b'b')
+        self.assertEqual(self.received(4), b'a' + bytes([IAC, IAC]) + b'b')
+
+    def test_escaped_iac_is_received_as_data(self):
+        self.server.sendall(b'a' + bytes([IAC, IAC]) + b'b' + PROMPT)
+        self.assertEqual(self.connection.read_until(PROMPT, timeout=2), b'a' + bytes([IAC]) + b'b' + PROMPT)
+
+    def test_escaped_iac_split_across_reads(self):
+        self.connection._process(b'a' + bytes([IAC]))
+        self.assertEqual(self.connection._buffer, b'a')
+        self.connection._process(bytes([IAC]) + b'b')
+        self.assertEqual(self.connection._buffer, b'a' + bytes([IAC]) + b'b')
+
+    def test_options_are_refused(self):
+        self.server.sendall(bytes([IAC, DO, 1, IAC, WILL, 3]) + PROMPT)
+        self.assertEqual(self.connection.read_until(PROMPT, timeout=2), PROMPT)
+        self.assertEqual(self.received(6), bytes([IAC, WONT, 1, IAC, DONT, 3]))
+
+    def test_option_split_across_reads(self):
+        self.connection._process(b'a' + bytes([IAC, DO]))
+        self.connection._process(bytes([1]) + b'b')
+        self.assertEqual(self.connection._buffer, b'ab')
+        self.assertEqual(self.received(3), bytes([IAC, WONT, 1]))
+
+    def test_subnegotiation_is_stripped(self):
+        self.connection._process(b'a' + bytes([IAC, SB, 24, 1]))
+        self.connection._process(bytes([IAC, SE]) + b'b')
+        self.assertEqual(self.connection._buffer, b'ab')
+
+    def test_expect_marker_split_across_reads(self):
+        thread = self.send_later(b'output>', b'>> ')
+        self.assertEqual(self.connection.expect([PROMPT], timeout=2), (0, b'output' + PROMPT))
+        thread.join()
+
+    def test_expect_returns_the_first_marker(self):
+        self.server.sendall(b'one' + RAW_REPL_END + b'two' + PROMPT)
+        self.assertEqual(self.connection.expect([PROMPT, RAW_REPL_END], timeout=2), (1, b'one' + RAW_REPL_END))
+        self.assertEqual(self.connection.expect([PROMPT, RAW_REPL_END], timeout=2), (0, b'two' + PROMPT))
+
+    def test_expect_timeout(self):
+        with self.assertRaises(BoardNotResponding):
+            self.connection.expect([PROMPT], timeout=.1)
+
+    def test_expect_closed_connection(self):
+        self.server.sendall(b'partial')
+        self.server.close()
+        with self.assertRaises(EOFError):
+            self.connection.expect([PROMPT], timeout=2)
+
+    def test_read_stream_marker_split_across_reads(self):
+        thread = self.send_later(b'out', b'put\x04', b'>rest')
+        chunks = list(self.connection.read_stream(RAW_REPL_END, timeout=2))
+        thread.join()
+        self.assertEqual(b''.join(chunks), b'output')
+        self.assertTrue(all(RAW_REPL_END[:1] not in chunk for chunk in chunks))
+        self.assertEqual(self.connection.read(4, timeout=2), b'rest')
+
+    def test_read_stream_yields_output_before_the_marker(self):
+        self.server.sendall(b'first chunk')
+        stream = self.connection.read_stream(RAW_REPL_END, timeout=2)
+        # The last byte is held back in case it starts the marker
+        self.assertEqual(next(stream), b'first chun')
+        self.server.sendall(RAW_REPL_END)
+        self.assertEqual(b''.join(stream), b'k')
+
+    def test_read_stream_timeout(self):
+        with self.assertRaises(BoardNotResponding):
+            list(self.connection.read_stream(RAW_REPL_END, timeout=.1))
+
+
+if __name__ == '__main__':
+    unittest.main()